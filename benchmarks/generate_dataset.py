@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+generate_dataset.py: Erzeugt eine synthetische jverein Datenbank (SQLite) für Benchmarks des Datev Exports
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import argparse
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+from typing import Iterator, Sequence
+
+from datev_export.example_custom_defines import JVEREIN_STEUER_KONTEN, KONTO_MAPPING
+
+SCHEMA = [
+    "CREATE TABLE buchungsart (id INTEGER PRIMARY KEY, nummer INTEGER, bezeichnung TEXT, art INTEGER)",
+    "CREATE TABLE konto (id INTEGER PRIMARY KEY, nummer TEXT, bezeichnung TEXT)",
+    "CREATE TABLE buchung ("
+    "id INTEGER PRIMARY KEY, umsatzid INTEGER, konto INTEGER, name TEXT, betrag DOUBLE, zweck TEXT, datum DATE, "
+    "art TEXT, kommentar TEXT, buchungsart INTEGER, splitid INTEGER, splittyp INTEGER)",
+    "CREATE INDEX buchung_datum ON buchung (datum)",
+]
+
+# Erlös- and Aufwandskonten without tax, (id, Datev nummer)
+BUCHUNGSARTEN = [(1, 8400, "Zweckbetrieb Erlöse"), (2, 4900, "Sonstige Kosten"), (3, 8200, "Mitgliedsbeiträge")]
+
+# splittyp of jverein: 1 = Hauptbuchung, 2 = Gegenbuchung, 3 = Splitbuchung
+SPLITTYP_HAUPT = 1
+SPLITTYP_GEGEN = 2
+SPLITTYP_SPLIT = 3
+
+
+def get_steuersatz(datum: date) -> int:
+    # 5% from July to December 2020, 7% otherwise, matching the example config
+    return 5 if date(2020, 7, 1) <= datum <= date(2020, 12, 31) else 7
+
+
+def generate_buchungen(rows: int, years: Sequence[int], seed: int) -> Iterator[tuple]:
+    rnd = random.Random(seed)
+    steuer_buchungsarten = {
+        konto.steuersatz: len(BUCHUNGSARTEN) + 1 + pos for pos, konto in enumerate(JVEREIN_STEUER_KONTEN)
+    }
+    first_day = date(min(years), 1, 1)
+    days = (date(max(years), 12, 31) - first_day).days + 1
+    id = 1
+    umsatzid = 1
+    while id <= rows:
+        konto = rnd.randrange(len(KONTO_MAPPING)) + 1
+        datum = first_day + timedelta(days=rnd.randrange(days))
+        name = str(100000 + umsatzid)
+        if rnd.random() < 0.6:
+            betrag = round(rnd.uniform(-800, 800), 2)
+            zweck = rnd.choice(["Mitgliedsbeitrag", "Spende", "Rechnung\r\nMaterial", "Hallenmiete"]) + f" {umsatzid}"
+            yield (id, umsatzid, konto, name, betrag, zweck, datum, None, None, rnd.randrange(1, 4), None, None)
+            id += 1
+        else:
+            # Sammelbuchung like jverein splits it: the Hauptbuchung, a Gegenbuchung cancelling it and the
+            # split parts, all with the id of the Hauptbuchung as splitid; only the parts are exported
+            haupt_id = id
+            parts = []
+            for pos in range(rnd.randrange(1, 12)):
+                netto = round(rnd.uniform(1, 300), 2) * rnd.choice([1, 1, -1])
+                zweck = f"Position {pos} Umsatz {umsatzid}"
+                parts.append((netto, zweck, 1))
+                if rnd.random() < 0.7:
+                    steuersatz = get_steuersatz(datum)
+                    if steuersatz == 5 and rnd.random() < 0.2:
+                        # booked with the old rate after the change, exported with Leistungsausgleich
+                        steuersatz = 7
+                    parts.append((round(netto * steuersatz / 100, 2), f"{zweck} USt", steuer_buchungsarten[steuersatz]))
+            if rnd.random() < 0.05:
+                parts.append((0.0, f"Nullbuchung Umsatz {umsatzid}", 1))
+            summe = round(sum(betrag for betrag, _, _ in parts), 2)
+            zweck = f"Sammelbuchung {umsatzid}"
+            yield (id, umsatzid, konto, name, summe, zweck, datum, None, None, 1, haupt_id, SPLITTYP_HAUPT)
+            yield (id + 1, umsatzid, konto, name, -summe, zweck, datum, None, None, 1, haupt_id, SPLITTYP_GEGEN)
+            id += 2
+            for betrag, zweck, buchungsart in parts:
+                yield (id, umsatzid, konto, name, betrag, zweck, datum, None, None, buchungsart, haupt_id, SPLITTYP_SPLIT)
+                id += 1
+        umsatzid += 1
+
+
+def generate_dataset(path: str, rows: int, years: Sequence[int], seed: int = 0):
+    if os.path.exists(path):
+        os.remove(path)
+    cnxn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        cnxn.execute(statement)
+    buchungsarten = list(BUCHUNGSARTEN)
+    for steuer_konto in JVEREIN_STEUER_KONTEN:
+        buchungsarten.append((len(buchungsarten) + 1, steuer_konto.jverein_konto_nr, steuer_konto.jverein_konto_name))
+    cnxn.executemany("INSERT INTO buchungsart VALUES (?, ?, ?, 0)", buchungsarten)
+    cnxn.executemany(
+        "INSERT INTO konto VALUES (?, ?, ?)",
+        [(pos + 1, str(mapping.datev_konto_nr), mapping.jverein_konto_name) for pos, mapping in enumerate(KONTO_MAPPING)],
+    )
+    cnxn.executemany(
+        "INSERT INTO buchung VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((*row[:6], row[6].isoformat(), *row[7:]) for row in generate_buchungen(rows, years, seed)),
+    )
+    cnxn.commit()
+    cnxn.close()
+
+
+def parse_args(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic 'jVerein' SQLite database.")
+    parser.add_argument("path", help="SQLite file to create", type=str)
+    parser.add_argument("--rows", default=1000, help="number of buchung rows (1k - 5M)", type=int)
+    parser.add_argument("--years", default="2019-2021", help="year range of the Buchungen, e.g. 2019-2021", type=str)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args(argv)
+    first, _, last = args.years.partition("-")
+    return {"path": args.path, "rows": args.rows, "years": range(int(first), int(last or first) + 1), "seed": args.seed}
+
+
+if __name__ == "__main__":
+    generate_dataset(**parse_args())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+run_benchmark.py: Misst Durchsatz und Speicherbedarf der einzelnen Schritte des Datev Exports
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import argparse
+import importlib
+import json
+import sys
+from typing import Dict, Sequence
+
+# the synthetic dataset is generated for the example config
+sys.modules["datev_export.custom_defines"] = importlib.import_module("datev_export.example_custom_defines")
+from datev_export import datev_export, profiling
+
+# header field "erzeugt am", differs for every export
+HEADER_TIMESTAMP_FIELD = 5
+
+
+def run_benchmark(db: str, year: int, output: str, engine: str = "loop", stream: bool = False, workers: int = 1) -> Dict:
+    """runs datev_export.main with the --profile profiler, the report has the stages of the export"""
+    profiler = profiling.enable_profiling()
+    datev_export.main(year, sqlite=db, output=output, engine=engine, stream=stream, workers=workers)
+    report = profiler.report()
+    rows = profiler.stages["write"].rows
+    report["options"] = {"engine": engine, "stream": stream, "workers": workers}
+    report["rows"] = rows
+    report["rows_per_sec"] = round(rows / report["total_seconds"]) if report["total_seconds"] else None
+    peak_rss_mb = profiling.get_peak_rss_mb()
+    report["peak_rss_mb"] = round(peak_rss_mb, 1) if peak_rss_mb is not None else None
+    return report
+
+
+def compare_golden(output: str, golden: str) -> bool:
+    # byte for byte, the golden export is cp1252 encoded like every Buchungsstapel
+    with open(output, "rb") as f, open(golden, "rb") as g:
+        header, golden_header = f.readline().split(b";"), g.readline().split(b";")
+        header[HEADER_TIMESTAMP_FIELD] = golden_header[HEADER_TIMESTAMP_FIELD] = b""
+        if header != golden_header:
+            return False
+        return f.read() == g.read()
+
+
+def parse_args(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the DATEV export on a synthetic 'jVerein' SQLite database.")
+    parser.add_argument("db", help="SQLite file created by generate_dataset.py", type=str)
+    parser.add_argument("--year", default=2020, type=int)
+    parser.add_argument("--output", default="bench_datev_export.csv", type=str)
+    parser.add_argument("--golden", default=None, help="golden export to compare the output with", type=str)
+    parser.add_argument("--engine", default="loop", choices=list(datev_export.ENGINES), help="row builder, see run.py")
+    parser.add_argument("--stream", action="store_true", help="stream the Buchungen one Umsatz at a time")
+    parser.add_argument("--workers", default=1, help="number of processes converting the Buchungen", type=int)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmark(args.db, args.year, args.output, args.engine, args.stream, args.workers)
+    if args.golden:
+        report["golden_match"] = compare_golden(args.output, args.golden)
+    print(json.dumps(report, indent=2))
+    if args.golden and not report["golden_match"]:
+        sys.exit(1)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+"""
+batch.py: Datev Export für mehrere Mandanten (Vereine) mit eigener Datenbank und eigener Konfiguration
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import concurrent.futures
+import dataclasses
+import importlib
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Union
+
+from datev_export.datasource import open_datasource
+
+# options of datev_export.main a manifest entry may set
+CLIENT_OPTIONS = ["stream", "workers", "engine", "incremental", "metadata_cache", "pool_size"]
+
+
+@dataclasses.dataclass
+class BatchClient:
+    """
+    One client of the manifest.
+    connection: keyword arguments of open_datasource (host/user/password/database, sqlite or snapshot)
+    config: module with KONTO_MAPPING and JVEREIN_STEUER_KONTEN, same layout as custom_defines
+    """
+
+    name: str
+    connection: Dict
+    berater: int
+    mandant: int
+    years: List[int]
+    config: str
+    options: Dict = dataclasses.field(default_factory=dict)
+
+
+def parse_year_range(years: Union[int, str, List[int]]) -> List[int]:
+    """2020, "2019-2021" or [2019, 2021]"""
+    if isinstance(years, list):
+        return [int(year) for year in years]
+    first, _, last = str(years).partition("-")
+    return list(range(int(first), int(last or first) + 1))
+
+
+def load_manifest(path: str) -> List[BatchClient]:
+    """
+    JSON manifest: {"clients": [{"name": ..., "connection": {...}, "berater": ..., "mandant": ...,
+    "years": "2019-2021", "config": "module", "options": {...}}, ...]}
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    clients = []
+    for entry in manifest["clients"]:
+        unknown = set(entry.get("options", {})) - set(CLIENT_OPTIONS)
+        if unknown:
+            raise ValueError(f"{entry['name']}: unknown options {sorted(unknown)}")
+        clients.append(
+            BatchClient(
+                name=entry["name"],
+                connection=entry["connection"],
+                berater=int(entry["berater"]),
+                mandant=int(entry["mandant"]),
+                years=parse_year_range(entry["years"]),
+                config=entry["config"],
+                options=entry.get("options", {}),
+            )
+        )
+    names = [client.name for client in clients]
+    if len(set(names)) != len(names):
+        raise ValueError("client names in the manifest must be unique, they are used as output directories")
+    return clients
+
+
+def export_client(client: BatchClient, output_dir: str) -> List[Dict]:
+    """
+    Exports all years of one client, runs in a worker process of run_batch.
+    Errors are reported in the result instead of being raised, so one client cannot stop the others.
+    """
+    result = {"client": client.name, "berater": client.berater, "mandant": client.mandant}
+    try:
+        config = importlib.import_module(client.config)
+        # datev_export reads custom_defines on import, which may not exist for a batch run
+        sys.modules.setdefault("datev_export.custom_defines", config)
+        from datev_export import datev_export
+
+        datev_export.set_config(config)
+        source = open_datasource(**client.connection)
+    except Exception as e:
+        return [dict(result, year=None, status="failed", error=f"{type(e).__name__}: {e}")]
+
+    results = []
+    os.makedirs(os.path.join(output_dir, client.name), exist_ok=True)
+    try:
+        for year in client.years:
+            output = os.path.join(output_dir, client.name, f"datev_export_{year}.csv")
+            options = dict(client.options)
+            if options.get("incremental"):
+                options["state_file"] = os.path.join(output_dir, client.name, f"datev_export_{year}.state.json")
+                # follow-up Buchungsstapel get their own file name
+                output = None
+            start = time.perf_counter()
+            try:
+                datev_export.main(
+                    year, source=source, output=output, berater=client.berater, mandant=client.mandant, **options
+                )
+                results.append(dict(result, year=year, status="ok", output=output))
+            except Exception as e:
+                results.append(dict(result, year=year, status="failed", error=f"{type(e).__name__}: {e}"))
+            results[-1]["seconds"] = round(time.perf_counter() - start, 3)
+    finally:
+        source.close()
+    return results
+
+
+def run_batch(clients: List[BatchClient], output_dir: str, workers: int = 4) -> Dict:
+    """exports the clients in a pool of at most workers processes and returns the summary"""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    results: Dict[str, List[Dict]] = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(export_client, client, output_dir): client for client in clients}
+        for future in concurrent.futures.as_completed(futures):
+            client = futures[future]
+            try:
+                results[client.name] = future.result()
+            except Exception as e:
+                # the worker process died (e.g. out of memory)
+                results[client.name] = [
+                    {"client": client.name, "year": None, "status": "failed", "error": f"{type(e).__name__}: {e}"}
+                ]
+            failed = sum(result["status"] != "ok" for result in results[client.name])
+            print(f"{client.name}: {'ok' if not failed else f'{failed} failed'}", file=sys.stderr)
+
+    exports = [result for client in clients for result in results[client.name]]
+    summary = {
+        "clients": len(clients),
+        "exports": len(exports),
+        "failed": sum(result["status"] != "ok" for result in exports),
+        "seconds": round(time.perf_counter() - start, 3),
+        "results": exports,
+    }
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
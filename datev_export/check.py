@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+check.py: Prüft ein ganzes Jahr vor dem Export und meldet alle Probleme auf einmal
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import collections
+from datetime import date
+from typing import Dict, Iterable, List, Tuple
+
+from datev_export.datasource import Buchung
+from datev_export.datev_defines import get_bu_index
+from datev_export.kontenplan import Kontenplan
+from datev_export.steuer_matching import NettoIndex
+
+# longest Buchungstext DATEV accepts
+BUCHUNGSTEXT_LAENGE = 60
+AUSGLEICH_PREFIX = "Ausgleich - "
+
+
+def problem(art: str, message: str, buchung: Buchung = None, **details) -> Dict:
+    """one entry of the check report, art is the kind of problem (see check_umsaetze)"""
+    entry = {"art": art, "message": message}
+    if buchung is not None:
+        entry.update(id=buchung.id, konto=buchung.konto, umsatz=buchung.name, datum=buchung.datum.isoformat())
+    entry.update(details)
+    return entry
+
+
+def check_metadaten(buchungsarten: Dict, konto_namen: Dict, kontenplan: Kontenplan) -> Tuple[List[Dict], Dict, Dict]:
+    """
+    Problems of the mappings, and the konten and jverein_steuer_konten which could be mapped
+    (Kontenplan.get_konten and get_jverein_steuer_konten raise on the first missing one)
+    """
+    problems = []
+    konten = {}
+    for id, name in konto_namen.items():
+        if name in kontenplan.datev_konten:
+            konten[id] = kontenplan.datev_konten[name]
+        else:
+            problems.append(problem("konto_ohne_mapping", f"Konto {name} has no KONTO_MAPPING", konto=id, name=name))
+
+    inv_buchungsarten = {v: k for k, v in buchungsarten.items()}
+    jverein_steuer_konten = {}
+    for steuer_konto in kontenplan.steuer_konten:
+        if steuer_konto.jverein_konto_nr in inv_buchungsarten:
+            jverein_steuer_konten[inv_buchungsarten[steuer_konto.jverein_konto_nr]] = steuer_konto
+        else:
+            problems.append(
+                problem(
+                    "steuerkonto_ohne_buchungsart",
+                    f"{steuer_konto.jverein_konto_name}: no Buchungsart {steuer_konto.jverein_konto_nr}",
+                    buchungsart=steuer_konto.jverein_konto_nr,
+                )
+            )
+    return problems, konten, jverein_steuer_konten
+
+
+class _DatumCheck:
+    """BU-Schlüssel and Leistungsdatum lookups, cached per (datum, key) as a year has at most 366 dates"""
+
+    def __init__(self, kontenplan: Kontenplan):
+        self.kontenplan = kontenplan
+        self._cache: Dict[Tuple[date, object], List[Tuple[str, str]]] = {}
+
+    def __call__(self, datum: date, key) -> List[Tuple[str, str]]:
+        problems = self._cache.get((datum, key))
+        if problems is None:
+            problems = self._cache[(datum, key)] = self._check(datum, key)
+        return problems
+
+    def _check(self, datum: date, key) -> List[Tuple[str, str]]:
+        # like build_records, the BU-Schlüssel is looked up for the datum of the Buchung first
+        problems = self._check_bu_schluessel(datum, key)
+        used_daterange = self.kontenplan.used_daterange.get(key)
+        if used_daterange is not None and datum not in used_daterange:
+            # Leistungsausgleich, the BU-Schlüssel is taken at the end of the last used period
+            try:
+                leistung_datum = used_daterange.last_end_before(datum)
+            except KeyError:
+                return problems + [
+                    ("steuerkonto_nicht_verwendet", f"{key} is not used on or before {datum} (used_daterange)")
+                ]
+            problems += self._check_bu_schluessel(leistung_datum, key)
+        return problems
+
+    @staticmethod
+    def _check_bu_schluessel(datum: date, key) -> List[Tuple[str, str]]:
+        index = get_bu_index(key)
+        pos = index.find(datum)
+        if pos < 0:
+            return [("bu_mapping_fehlt", f"{datum} is not covered by {index.name}")]
+        if key not in index.values[pos]:
+            return [("bu_schluessel_fehlt", f"{index.name} has no BU-Schlüssel for {key} on {datum}")]
+        return []
+
+
+def check_umsaetze(
+    umsaetze: Iterable[Tuple[int, str, List[Buchung]]],
+    buchungsarten: Dict,
+    konto_namen: Dict,
+    kontenplan: Kontenplan,
+    leistungsausgleich: bool = True,
+) -> List[Dict]:
+    """
+    Runs every check of the export over all Umsätze without stopping at the first problem.
+    Kinds of problems (art): konto_ohne_mapping, steuerkonto_ohne_buchungsart, konto_unbekannt,
+    belegfeld_ungueltig, netto_buchung_fehlt, netto_buchung_mehrdeutig, buchungsart_fehlt,
+    steuerkonto_nicht_verwendet, bu_mapping_fehlt, bu_schluessel_fehlt and buchungstext_zu_lang.
+    """
+    problems, konten, jverein_steuer_konten = check_metadaten(buchungsarten, konto_namen, kontenplan)
+    buchungen_je_konto = collections.Counter()
+    datum_check = _DatumCheck(kontenplan)
+
+    for konto, umsatzid, umsatz_buchungen in umsaetze:
+        buchungen_je_konto[konto] += len(umsatz_buchungen)
+        if konto not in konto_namen:
+            problems.append(problem("konto_unbekannt", f"Konto {konto} does not exist", umsatz_buchungen[0]))
+        if not str(umsatzid).isdigit():
+            problems.append(problem("belegfeld_ungueltig", f"Umsatz {umsatzid!r} is no number", umsatz_buchungen[0]))
+
+        # same pairing as split_steuer_tupel, but unmatched Steuerbuchungen are reported and skipped
+        betraege = [buchung.betrag for buchung in umsatz_buchungen]
+        buschluessel = [None] * len(umsatz_buchungen)
+        netto_index = NettoIndex(range(len(umsatz_buchungen)), betraege, [buchung.zweck for buchung in umsatz_buchungen])
+        for steuer_buchung in umsatz_buchungen:
+            steuer_konto = jverein_steuer_konten.get(steuer_buchung.buchungsart)
+            if steuer_konto is None:
+                continue
+            kandidaten = netto_index.candidates(steuer_buchung.betrag, steuer_buchung.zweck, steuer_konto.steuersatz)
+            if len(kandidaten) == 0:
+                problems.append(problem("netto_buchung_fehlt", "Cannot find corresponding netto Buchung", steuer_buchung))
+                continue
+            if len(kandidaten) > 1:
+                problems.append(
+                    problem(
+                        "netto_buchung_mehrdeutig",
+                        "Netto Buchung is not unique",
+                        steuer_buchung,
+                        kandidaten=[umsatz_buchungen[pos].id for pos in kandidaten],
+                    )
+                )
+                continue
+            pos = kandidaten[0]
+            netto_index.mark_used(pos)
+            betraege[pos] = round(betraege[pos] + steuer_buchung.betrag, 2)
+            buschluessel[pos] = steuer_konto.buschluessel
+
+        for buchung, betrag, key in zip(umsatz_buchungen, betraege, buschluessel):
+            if buchung.buchungsart in jverein_steuer_konten or betrag == 0:
+                continue
+            if buchung.buchungsart not in buchungsarten:
+                problems.append(problem("buchungsart_fehlt", f"unknown Buchungsart {buchung.buchungsart}", buchung))
+            ausgleich = False
+            if key is not None:
+                for art, message in datum_check(buchung.datum, key):
+                    problems.append(problem(art, message, buchung))
+                ausgleich = leistungsausgleich and buchung.datum not in kontenplan.used_daterange[key]
+            text = buchung.zweck.replace("\r", "").replace("\n", "")
+            laenge = len(text) + (len(AUSGLEICH_PREFIX) if ausgleich else 0)
+            if laenge > BUCHUNGSTEXT_LAENGE:
+                problems.append(
+                    problem(
+                        "buchungstext_zu_lang",
+                        f"Buchungstext has {laenge} instead of at most {BUCHUNGSTEXT_LAENGE} characters",
+                        buchung,
+                    )
+                )
+
+    # an unmapped Konto is reported once, with the number of its Buchungen
+    for entry in problems:
+        if entry["art"] == "konto_ohne_mapping":
+            entry["buchungen"] = buchungen_je_konto[entry["konto"]]
+    return problems
+
+
+def summarize(problems: List[Dict]) -> Dict[str, int]:
+    return dict(collections.Counter(entry["art"] for entry in problems))
@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+
+"""
+datasource.py: Liest Buchungen, Buchungsarten und Konten aus MySQL, einer DB-API Verbindung oder einem Snapshot
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from operator import itemgetter
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Tuple, Union
+
+from datev_export.watermark import BuchungStand, get_buchung_stand, get_buchung_stand_from_rows
+
+if TYPE_CHECKING:
+    # pandas and mysql.connector are imported on first use, the tuple engine works without pandas
+    import mysql.connector
+    import pandas as pd
+
+FETCH_BATCH_SIZE = 10000
+# columns of jverein.buchung used by the export and their dtypes
+BUCHUNG_COLUMNS = {
+    "id": "int64",
+    "konto": "int64",
+    "name": object,
+    "betrag": "float64",
+    "zweck": object,
+    "datum": object,
+    "buchungsart": "Int64",
+}
+BUCHUNG_QUERY = (
+    f"SELECT {', '.join(BUCHUNG_COLUMNS)} FROM buchung "
+    "WHERE datum >= %s AND datum <= %s AND (splitid IS NULL OR splittyp = 3)"
+)
+SNAPSHOT_TABLES = ["buchung", "buchungsart", "konto"]
+
+# one row of BUCHUNG_QUERY for the tuple engine
+Buchung = collections.namedtuple("Buchung", list(BUCHUNG_COLUMNS))
+# netto Buchung with its Steuerbuchung already added (brutto betrag) by get_gepaarte_umsaetze
+GepaarteBuchung = collections.namedtuple("GepaarteBuchung", list(BUCHUNG_COLUMNS) + ["buschluessel"])
+
+# "zweck of the Steuerbuchung t starts with zweck of the netto Buchung n", case and byte exact, per SQL dialect
+ZWECK_PREFIX_SQL = {
+    "mysql": "LEFT(t.zweck, CHAR_LENGTH(n.zweck)) = BINARY n.zweck",
+    "sqlite": "SUBSTR(t.zweck, 1, LENGTH(n.zweck)) = n.zweck",
+}
+# Steuer of the netto Buchung n in cents before rounding; on a half cent Python (half to even) and the
+# databases (SQLite half away from zero, MySQL DOUBLE depends on the C library) round differently
+STEUER_CENT_SQL = "n.betrag * s.steuersatz"
+HALBER_CENT_SQL = f"ABS(ABS({STEUER_CENT_SQL} - ROUND({STEUER_CENT_SQL})) - 0.5) < 0.000001"
+# order of the streamed Buchungen: the Buchungen of an Umsatz must be neighbours for groupby, which compares
+# the names byte exact, not with the collation of the database (MySQL's _ci collations ignore case and trailing spaces)
+UMSATZ_ORDER_SQL = {
+    "mysql": "konto, BINARY name, id",
+    "sqlite": "konto, name, id",
+}
+
+
+def iter_batches(crsr, batch_size: int = FETCH_BATCH_SIZE) -> Iterator[List[tuple]]:
+    while True:
+        rows = crsr.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def rows_to_frame(names: List[str], rows: List[tuple], dtypes: Dict[str, str]) -> "pd.DataFrame":
+    import pandas as pd
+
+    # transpose the rows once and store every column with its final dtype
+    columns = zip(*rows) if rows else [()] * len(names)
+    return pd.DataFrame({name: pd.array(values, dtype=dtypes.get(name, object)) for name, values in zip(names, columns)})
+
+
+def fetch_frame(crsr, dtypes: Dict[str, str], batch_size: int = FETCH_BATCH_SIZE) -> "pd.DataFrame":
+    import pandas as pd
+
+    names = [column[0] for column in crsr.description]
+    frames = [rows_to_frame(names, rows, dtypes) for rows in iter_batches(crsr, batch_size)]
+    return pd.concat(frames, ignore_index=True) if frames else rows_to_frame(names, [], dtypes)
+
+
+def fetch_buchung_tupel(crsr, batch_size: int = FETCH_BATCH_SIZE) -> List[Buchung]:
+    return [Buchung._make(row) for rows in iter_batches(crsr, batch_size) for row in rows]
+
+
+def frame_to_buchung_tupel(buchungen: "pd.DataFrame") -> List[Buchung]:
+    return [Buchung._make(row) for row in buchungen[list(BUCHUNG_COLUMNS)].itertuples(index=False, name=None)]
+
+
+def get_buchung_query(year: int, max_id: int = None, last_year: int = None) -> Tuple[str, tuple]:
+    # all Buchungen of the year (up to last_year), split Buchungen only as their parts (splittyp 3)
+    query = BUCHUNG_QUERY
+    params = (datetime.date(year, 1, 1), datetime.date(last_year or year, 12, 31))
+    if max_id is not None:
+        query += " AND id <= %s"
+        params += (max_id,)
+    return query, params
+
+
+def get_buchungen(crsr, year: int, max_id: int = None, last_year: int = None) -> "pd.DataFrame":
+    crsr: mysql.connector.connection_cext.CMySQLCursor
+    crsr.execute(*get_buchung_query(year, max_id, last_year))
+    buchungen = fetch_frame(crsr, BUCHUNG_COLUMNS)
+    return buchungen.assign(buschluessel=math.nan)
+
+
+def get_buchung_tupel(crsr, year: int, max_id: int = None, last_year: int = None) -> List[Buchung]:
+    crsr: mysql.connector.connection_cext.CMySQLCursor
+    crsr.execute(*get_buchung_query(year, max_id, last_year))
+    return fetch_buchung_tupel(crsr)
+
+
+def execute_neue_buchungen(crsr, year: int, watermark_id: int, max_id: int):
+    """
+    All Buchungen of the Umsätze which got a Buchung with id > watermark_id,
+    including their older Buchungen (these mean an already exported Umsatz was changed).
+    """
+    crsr: mysql.connector.connection_cext.CMySQLCursor
+    query, params = get_buchung_query(year, max_id)
+    crsr.execute(
+        f"{query} AND (konto, name) IN (SELECT konto, name FROM buchung WHERE id > %s AND datum >= %s AND datum <= %s)",
+        params + (watermark_id,) + params[:2],
+    )
+
+
+def get_neue_buchungen(crsr, year: int, watermark_id: int, max_id: int) -> "pd.DataFrame":
+    execute_neue_buchungen(crsr, year, watermark_id, max_id)
+    buchungen = fetch_frame(crsr, BUCHUNG_COLUMNS)
+    return buchungen.assign(buschluessel=math.nan)
+
+
+def get_neue_buchung_tupel(crsr, year: int, watermark_id: int, max_id: int) -> List[Buchung]:
+    execute_neue_buchungen(crsr, year, watermark_id, max_id)
+    return fetch_buchung_tupel(crsr)
+
+
+def iter_umsatz_rows(
+    crsr, year: int, max_id: int = None, batch_size: int = FETCH_BATCH_SIZE, dialect: str = "mysql"
+) -> Iterator[Tuple[int, str, List[str], List[tuple]]]:
+    """
+    Streams the Buchungen of a year ordered by (konto, name) and yields the rows of one Umsatz at a time,
+    so only the current Umsatz is held in memory. Needs an unbuffered cursor to be effective.
+    Rows without name are skipped, just like groupby("name") drops them.
+    """
+    crsr: mysql.connector.connection_cext.CMySQLCursor
+    query, params = get_buchung_query(year, max_id)
+    crsr.execute(f"{query} AND name IS NOT NULL ORDER BY {UMSATZ_ORDER_SQL[dialect]}", params)
+    names = [column[0] for column in crsr.description]
+    umsatz_key = itemgetter(names.index("konto"), names.index("name"))
+    rows = itertools.chain.from_iterable(iter_batches(crsr, batch_size))
+    for (konto, umsatzid), umsatz_rows in itertools.groupby(rows, umsatz_key):
+        yield konto, umsatzid, names, list(umsatz_rows)
+
+
+def iter_umsatz_gruppen(
+    crsr, year: int, max_id: int = None, batch_size: int = FETCH_BATCH_SIZE, dialect: str = "mysql"
+) -> Iterator[Tuple[int, str, "pd.DataFrame"]]:
+    for konto, umsatzid, names, umsatz_rows in iter_umsatz_rows(crsr, year, max_id, batch_size, dialect):
+        umsatz_buchungen = rows_to_frame(names, umsatz_rows, BUCHUNG_COLUMNS)
+        yield konto, umsatzid, umsatz_buchungen.assign(buschluessel=math.nan)
+
+
+def iter_umsatz_tupel(
+    crsr, year: int, max_id: int = None, batch_size: int = FETCH_BATCH_SIZE, dialect: str = "mysql"
+) -> Iterator[Tuple[int, str, List[Buchung]]]:
+    for konto, umsatzid, _, umsatz_rows in iter_umsatz_rows(crsr, year, max_id, batch_size, dialect):
+        yield konto, umsatzid, [Buchung._make(row) for row in umsatz_rows]
+
+
+def get_steuer_paare_query(year: int, max_id: int, jverein_steuer_konten: Dict, dialect: str = "mysql") -> Tuple[str, tuple]:
+    """
+    Common table expressions pairing every Steuerbuchung with its netto Buchung in the database,
+    with the same rules as split_steuer_buchungen: same Umsatz (konto, name), betrag * steuersatz
+    within one cent of the Steuer and the zweck of the Steuerbuchung starts with the netto zweck.
+    The database's rounding is not trusted for a Steuer of exactly half a cent: such netto Buchungen are
+    candidates under either rounding and leave the Steuerbuchung open.
+    paare: all candidate pairs with the number of candidates of both sides,
+    offene_steuer: Steuerbuchungen without exactly one candidate which is not claimed by another one
+    or with a half cent candidate,
+    offene_umsaetze: their Umsätze, these are paired in Python (and fail there if they are really ambiguous).
+    Needs window functions (MySQL 8, SQLite 3.25).
+    """
+    query, params = get_buchung_query(year, max_id)
+    steuer_konten = list(jverein_steuer_konten.items())
+    steuer_query = " UNION ALL ".join(["SELECT %s AS buchungsart, %s AS steuersatz, %s AS schluessel"] * len(steuer_konten))
+    steuer_params = tuple(
+        value
+        for pos, (buchungsart, steuer_konto) in enumerate(steuer_konten)
+        for value in (buchungsart, steuer_konto.steuersatz, pos)
+    )
+    cte = f"""WITH buchungen AS ({query}),
+steuer_konten AS ({steuer_query}),
+paare AS (
+    SELECT t.id AS steuer_id, n.id AS netto_id, t.betrag AS steuer_betrag, s.schluessel,
+        CASE WHEN {HALBER_CENT_SQL} THEN 1 ELSE 0 END AS halber_cent,
+        COUNT(*) OVER (PARTITION BY t.id) AS netto_kandidaten,
+        COUNT(*) OVER (PARTITION BY n.id) AS steuer_kandidaten
+    FROM buchungen t
+    JOIN steuer_konten s ON s.buchungsart = t.buchungsart
+    JOIN buchungen n ON n.konto = t.konto AND n.name = t.name
+    WHERE (
+            ABS(ROUND(ROUND({STEUER_CENT_SQL} / 100, 2) * 100) - ROUND(t.betrag * 100)) <= 1
+            OR {HALBER_CENT_SQL} AND ABS({STEUER_CENT_SQL} - ROUND(t.betrag * 100)) < 2
+        )
+        AND {ZWECK_PREFIX_SQL[dialect]}
+),
+offene_steuer AS (
+    SELECT t.id, t.konto, t.name, t.betrag, t.zweck, COUNT(p.steuer_id) AS netto_kandidaten
+    FROM buchungen t
+    JOIN steuer_konten s ON s.buchungsart = t.buchungsart
+    LEFT JOIN paare p ON p.steuer_id = t.id
+    WHERE t.name IS NOT NULL
+    GROUP BY t.id, t.konto, t.name, t.betrag, t.zweck
+    HAVING COUNT(p.steuer_id) <> 1 OR MAX(p.steuer_kandidaten) <> 1 OR MAX(p.halber_cent) = 1
+),
+offene_umsaetze AS (SELECT DISTINCT konto, name FROM offene_steuer)
+"""
+    return cte, params + steuer_params
+
+
+def get_gepaarte_umsaetze(
+    crsr, year: int, max_id: int, jverein_steuer_konten: Dict, dialect: str = "mysql"
+) -> List[Tuple[int, str, List[Union[GepaarteBuchung, Buchung]]]]:
+    """
+    Umsätze of a year ordered like iter_umsaetze, paired in the database (see get_steuer_paare_query):
+    the netto Buchungen with brutto betrag and buschluessel as GepaarteBuchung, without Steuerbuchungen.
+    Umsätze the database could not pair unambiguously are returned complete as Buchung tuples.
+    """
+    crsr: mysql.connector.connection_cext.CMySQLCursor
+    cte, params = get_steuer_paare_query(year, max_id, jverein_steuer_konten, dialect)
+    crsr.execute(
+        f"""{cte}
+SELECT b.id, b.konto, b.name,
+    CASE WHEN o.konto IS NULL THEN b.betrag + COALESCE(p.steuer_betrag, 0) ELSE b.betrag END AS betrag,
+    b.zweck, b.datum, b.buchungsart, p.schluessel, o.konto IS NOT NULL AS offen
+FROM buchungen b
+LEFT JOIN offene_umsaetze o ON o.konto = b.konto AND o.name = b.name
+LEFT JOIN paare p ON p.netto_id = b.id AND o.konto IS NULL
+WHERE b.name IS NOT NULL
+    AND (o.konto IS NOT NULL OR NOT EXISTS (SELECT 1 FROM steuer_konten s WHERE s.buchungsart = b.buchungsart))
+ORDER BY b.konto, b.name, b.id""",
+        params,
+    )
+    buschluessel = [steuer_konto.buschluessel for steuer_konto in jverein_steuer_konten.values()]
+    rows = [row for rows in iter_batches(crsr) for row in rows]
+    # same order as groupby, independent of the collation of the database
+    rows.sort(key=itemgetter(1, 2))
+    umsaetze = []
+    for (konto, umsatzid), umsatz_rows in itertools.groupby(rows, itemgetter(1, 2)):
+        umsatz_rows = list(umsatz_rows)
+        if umsatz_rows[0][-1]:
+            umsaetze.append((konto, umsatzid, [Buchung._make(row[:-2]) for row in umsatz_rows]))
+            continue
+        umsatz_buchungen = []
+        for *row, schluessel, _ in umsatz_rows:
+            if schluessel is not None:
+                # the sum is computed in the database, rounded like split_steuer_buchungen
+                row[3] = round(row[3], 2)
+                schluessel = buschluessel[schluessel]
+            umsatz_buchungen.append(GepaarteBuchung(*row, schluessel))
+        umsaetze.append((konto, umsatzid, umsatz_buchungen))
+    return umsaetze
+
+
+def get_offene_steuer_buchungen(
+    crsr, year: int, max_id: int, jverein_steuer_konten: Dict, dialect: str = "mysql"
+) -> List[Dict]:
+    """Steuerbuchungen the database cannot pair unambiguously, with their number of netto candidates"""
+    crsr: mysql.connector.connection_cext.CMySQLCursor
+    cte, params = get_steuer_paare_query(year, max_id, jverein_steuer_konten, dialect)
+    crsr.execute(
+        f"{cte}SELECT id, konto, name, betrag, zweck, netto_kandidaten FROM offene_steuer ORDER BY konto, name, id", params
+    )
+    names = [column[0] for column in crsr.description]
+    return [dict(zip(names, row)) for row in crsr.fetchall()]
+
+
+def get_buchungsarten(crsr) -> Dict:
+    crsr: mysql.connector.connection_cext.CMySQLCursor
+    crsr.execute("SELECT * FROM buchungsart")
+    buchungsarten = {col[0]: col[1] for col in crsr.fetchall()}
+    return buchungsarten
+
+
+def get_konto_namen(crsr) -> Dict:
+    crsr: mysql.connector.connection_cext.CMySQLCursor
+    crsr.execute("SELECT * FROM konto")
+    konto_namen = {col[0]: col[2] for col in crsr.fetchall()}
+    return konto_namen
+
+
+def get_metadaten_checksum(crsr) -> List:
+    # covers row count and content of both tables in one round trip
+    crsr.execute("CHECKSUM TABLE buchungsart, konto")
+    return [list(row) for row in crsr.fetchall()]
+
+
+def load_metadaten(crsr, cache_file: str = None) -> Tuple[Dict, Dict]:
+    """
+    buchungsart and konto tables, read from cache_file as long as the table checksums are unchanged
+    """
+    if cache_file is None:
+        return get_buchungsarten(crsr), get_konto_namen(crsr)
+
+    checksum = get_metadaten_checksum(crsr)
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+        if cache["checksum"] == checksum:
+            # json only knows str keys, the tables are stored as lists of pairs
+            return dict(map(tuple, cache["buchungsarten"])), dict(map(tuple, cache["konto_namen"]))
+
+    buchungsarten, konto_namen = get_buchungsarten(crsr), get_konto_namen(crsr)
+    cache = {"checksum": checksum, "buchungsarten": list(buchungsarten.items()), "konto_namen": list(konto_namen.items())}
+    with open(f"{cache_file}.part", "w") as f:
+        json.dump(cache, f)
+    os.replace(f"{cache_file}.part", cache_file)
+    return buchungsarten, konto_namen
+
+
+def get_tables(crsr) -> Dict[str, "pd.DataFrame"]:
+    tables = {}
+    for table in SNAPSHOT_TABLES:
+        crsr.execute(f"SELECT * FROM {table}")
+        tables[table] = fetch_frame(crsr, BUCHUNG_COLUMNS if table == "buchung" else {})
+    return tables
+
+
+class DataSource:
+    """
+    Where the export reads its tables from.
+    buchungsarten: jverein buchungsart id -> nummer, konto_namen: jverein konto id -> bezeichnung
+    """
+
+    def get_metadaten(self, cache_file: str = None) -> Tuple[Dict, Dict]:
+        raise NotImplementedError
+
+    def get_buchungen(self, year: int, max_id: int = None, last_year: int = None) -> "pd.DataFrame":
+        """Buchungen of the year, or of all years from year to last_year"""
+        raise NotImplementedError
+
+    def iter_umsatz_gruppen(self, year: int, max_id: int = None) -> Iterator[Tuple[int, str, "pd.DataFrame"]]:
+        raise NotImplementedError
+
+    def get_neue_buchungen(self, year: int, watermark_id: int, max_id: int) -> "pd.DataFrame":
+        raise NotImplementedError
+
+    # the *_tupel methods return plain Buchung tuples for the tuple engine,
+    # sources reading from a cursor override them to work without pandas
+    def get_buchung_tupel(self, year: int, max_id: int = None, last_year: int = None) -> List[Buchung]:
+        return frame_to_buchung_tupel(self.get_buchungen(year, max_id, last_year))
+
+    def iter_umsatz_tupel(self, year: int, max_id: int = None) -> Iterator[Tuple[int, str, List[Buchung]]]:
+        for konto, umsatzid, umsatz_buchungen in self.iter_umsatz_gruppen(year, max_id):
+            yield konto, umsatzid, frame_to_buchung_tupel(umsatz_buchungen)
+
+    def get_neue_buchung_tupel(self, year: int, watermark_id: int, max_id: int) -> List[Buchung]:
+        return frame_to_buchung_tupel(self.get_neue_buchungen(year, watermark_id, max_id))
+
+    def get_buchung_stand(self, year: int, max_id: int = None) -> BuchungStand:
+        return get_buchung_stand_from_rows(self.get_buchung_tupel(year, max_id))
+
+    def get_gepaarte_umsaetze(
+        self, year: int, max_id: int, jverein_steuer_konten: Dict
+    ) -> List[Tuple[int, str, List[Union[GepaarteBuchung, Buchung]]]]:
+        """Umsätze with Steuerbuchungen paired in the database, for the sql engine"""
+        raise NotImplementedError(f"{type(self).__name__} cannot pair Steuerbuchungen in SQL")
+
+    def get_offene_steuer_buchungen(self, year: int, max_id: int, jverein_steuer_konten: Dict) -> List[Dict]:
+        raise NotImplementedError(f"{type(self).__name__} cannot pair Steuerbuchungen in SQL")
+
+    def get_export_daten(
+        self, year: int, max_id: int = None, cache_file: str = None, tupel: bool = False, last_year: int = None
+    ) -> Tuple[Tuple[Dict, Dict], Union["pd.DataFrame", List[Buchung]]]:
+        """metadata and Buchungen of a year (up to last_year), sources with a connection pool fetch them concurrently"""
+        get_buchungen = self.get_buchung_tupel if tupel else self.get_buchungen
+        return self.get_metadaten(cache_file), get_buchungen(year, max_id, last_year)
+
+    def get_tables(self) -> Dict[str, "pd.DataFrame"]:
+        """complete tables for a snapshot"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class _QmarkCursor:
+    """cursor of a DB-API module with paramstyle qmark accepting the %s placeholders of the export queries"""
+
+    def __init__(self, crsr):
+        self._crsr = crsr
+
+    def execute(self, query: str, params: tuple = ()):
+        self._crsr.execute(query.replace("%s", "?"), params)
+
+    def __getattr__(self, name):
+        return getattr(self._crsr, name)
+
+
+class DbApiSource(DataSource):
+    """any DB-API 2.0 connection, e.g. sqlite3 (paramstyle qmark) or MySQL (paramstyle format)"""
+
+    def __init__(self, cnxn, paramstyle: str = "format", dialect: str = "mysql"):
+        self.cnxn = cnxn
+        self.paramstyle = paramstyle
+        self.dialect = dialect
+
+    def cursor(self, buffered: bool = True):
+        crsr = self.cnxn.cursor()
+        return _QmarkCursor(crsr) if self.paramstyle == "qmark" else crsr
+
+    def get_metadaten(self, cache_file: str = None) -> Tuple[Dict, Dict]:
+        if cache_file is not None:
+            raise ValueError("the metadata cache is validated with CHECKSUM TABLE and only works with MySQL")
+        crsr = self.cursor()
+        return get_buchungsarten(crsr), get_konto_namen(crsr)
+
+    def get_buchungen(self, year: int, max_id: int = None, last_year: int = None) -> "pd.DataFrame":
+        return get_buchungen(self.cursor(), year, max_id, last_year)
+
+    def iter_umsatz_gruppen(self, year: int, max_id: int = None) -> Iterator[Tuple[int, str, "pd.DataFrame"]]:
+        return iter_umsatz_gruppen(self.cursor(buffered=False), year, max_id, dialect=self.dialect)
+
+    def get_neue_buchungen(self, year: int, watermark_id: int, max_id: int) -> "pd.DataFrame":
+        return get_neue_buchungen(self.cursor(), year, watermark_id, max_id)
+
+    def get_buchung_tupel(self, year: int, max_id: int = None, last_year: int = None) -> List[Buchung]:
+        return get_buchung_tupel(self.cursor(), year, max_id, last_year)
+
+    def iter_umsatz_tupel(self, year: int, max_id: int = None) -> Iterator[Tuple[int, str, List[Buchung]]]:
+        return iter_umsatz_tupel(self.cursor(buffered=False), year, max_id, dialect=self.dialect)
+
+    def get_neue_buchung_tupel(self, year: int, watermark_id: int, max_id: int) -> List[Buchung]:
+        return get_neue_buchung_tupel(self.cursor(), year, watermark_id, max_id)
+
+    def get_gepaarte_umsaetze(
+        self, year: int, max_id: int, jverein_steuer_konten: Dict
+    ) -> List[Tuple[int, str, List[Union[GepaarteBuchung, Buchung]]]]:
+        return get_gepaarte_umsaetze(self.cursor(), year, max_id, jverein_steuer_konten, self.dialect)
+
+    def get_offene_steuer_buchungen(self, year: int, max_id: int, jverein_steuer_konten: Dict) -> List[Dict]:
+        return get_offene_steuer_buchungen(self.cursor(), year, max_id, jverein_steuer_konten, self.dialect)
+
+    def get_tables(self) -> Dict[str, "pd.DataFrame"]:
+        return get_tables(self.cursor())
+
+    def close(self):
+        self.cnxn.close()
+
+
+class MySQLSource(DbApiSource):
+    def __init__(self, host: str, user: str, password: str, database: str):
+        import mysql.connector
+
+        cnxn: mysql.connector.CMySQLConnection
+        cnxn = mysql.connector.connect(host=host, user=user, password=password, database=database)
+        super().__init__(cnxn)
+
+    def cursor(self, buffered: bool = True):
+        return self.cnxn.cursor(buffered=buffered)
+
+    def get_metadaten(self, cache_file: str = None) -> Tuple[Dict, Dict]:
+        return load_metadaten(self.cursor(), cache_file)
+
+    def get_buchung_stand(self, year: int, max_id: int = None) -> BuchungStand:
+        return get_buchung_stand(self.cursor(), *get_buchung_query(year, max_id))
+
+
+class MySQLPoolSource(DataSource):
+    """
+    MySQL with a connection pool: independent queries run concurrently in a thread pool of the same size.
+    The pool can be reused for several exports, query_timings records every query.
+    """
+
+    def __init__(self, host: str, user: str, password: str, database: str, pool_size: int = 4):
+        from mysql.connector import pooling
+
+        self.pool_size = pool_size
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name="datev_export", pool_size=pool_size, host=host, user=user, password=password, database=database
+        )
+        self.query_timings: List[Dict] = []
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size)
+
+    @contextlib.contextmanager
+    def _cursor(self, name: str, buffered: bool = True):
+        # closing a pooled connection returns it to the pool
+        cnxn = self.pool.get_connection()
+        start = time.perf_counter()
+        try:
+            yield cnxn.cursor(buffered=buffered)
+        finally:
+            cnxn.close()
+            self.query_timings.append(
+                {"query": name, "seconds": round(time.perf_counter() - start, 4), "thread": threading.current_thread().name}
+            )
+
+    def _run(self, name: str, function: Callable, *args):
+        with self._cursor(name) as crsr:
+            return function(crsr, *args)
+
+    def get_metadaten(self, cache_file: str = None) -> Tuple[Dict, Dict]:
+        # every query runs in the executor, which has no more threads than the pool has connections:
+        # get_connection does not wait for a free connection but fails when the pool is exhausted
+        if cache_file is not None:
+            return self._executor.submit(self._run, "metadaten", load_metadaten, cache_file).result()
+        buchungsarten = self._executor.submit(self._run, "buchungsart", get_buchungsarten)
+        konto_namen = self._executor.submit(self._run, "konto", get_konto_namen)
+        return buchungsarten.result(), konto_namen.result()
+
+    def get_buchungen(self, year: int, max_id: int = None, last_year: int = None) -> "pd.DataFrame":
+        return self._run(f"buchung {year}", get_buchungen, year, max_id, last_year)
+
+    def iter_umsatz_gruppen(self, year: int, max_id: int = None) -> Iterator[Tuple[int, str, "pd.DataFrame"]]:
+        with self._cursor(f"buchung {year} (stream)", buffered=False) as crsr:
+            yield from iter_umsatz_gruppen(crsr, year, max_id)
+
+    def get_neue_buchungen(self, year: int, watermark_id: int, max_id: int) -> "pd.DataFrame":
+        return self._run(f"neue buchung {year}", get_neue_buchungen, year, watermark_id, max_id)
+
+    def get_buchung_tupel(self, year: int, max_id: int = None, last_year: int = None) -> List[Buchung]:
+        return self._run(f"buchung {year}", get_buchung_tupel, year, max_id, last_year)
+
+    def iter_umsatz_tupel(self, year: int, max_id: int = None) -> Iterator[Tuple[int, str, List[Buchung]]]:
+        with self._cursor(f"buchung {year} (stream)", buffered=False) as crsr:
+            yield from iter_umsatz_tupel(crsr, year, max_id)
+
+    def get_neue_buchung_tupel(self, year: int, watermark_id: int, max_id: int) -> List[Buchung]:
+        return self._run(f"neue buchung {year}", get_neue_buchung_tupel, year, watermark_id, max_id)
+
+    def get_gepaarte_umsaetze(
+        self, year: int, max_id: int, jverein_steuer_konten: Dict
+    ) -> List[Tuple[int, str, List[Union[GepaarteBuchung, Buchung]]]]:
+        return self._run(f"steuer paare {year}", get_gepaarte_umsaetze, year, max_id, jverein_steuer_konten)
+
+    def get_offene_steuer_buchungen(self, year: int, max_id: int, jverein_steuer_konten: Dict) -> List[Dict]:
+        return self._run(f"offene steuer {year}", get_offene_steuer_buchungen, year, max_id, jverein_steuer_konten)
+
+    def get_buchung_stand(self, year: int, max_id: int = None) -> BuchungStand:
+        return self._run(f"stand {year}", get_buchung_stand, *get_buchung_query(year, max_id))
+
+    def get_export_daten(
+        self, year: int, max_id: int = None, cache_file: str = None, tupel: bool = False, last_year: int = None
+    ) -> Tuple[Tuple[Dict, Dict], Union["pd.DataFrame", List[Buchung]]]:
+        get_buchungen = self.get_buchung_tupel if tupel else self.get_buchungen
+        buchungen = self._executor.submit(get_buchungen, year, max_id, last_year)
+        return self.get_metadaten(cache_file), buchungen.result()
+
+    def get_tables(self) -> Dict[str, "pd.DataFrame"]:
+        return self._run("snapshot", get_tables)
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class SnapshotSource(DataSource):
+    """
+    Feather (Arrow IPC) files of the buchung, buchungsart and konto tables written by write_snapshot.
+    The files are memory mapped, Buchungen are filtered by datum and splittyp in Arrow and only the
+    requested year with the columns used by the export is converted to pandas.
+    """
+
+    def __init__(self, directory: str):
+        import pyarrow.dataset as ds
+        from pyarrow import fs
+
+        self.directory = directory
+        self.buchung = ds.dataset(self._path("buchung"), format="ipc", filesystem=fs.LocalFileSystem(use_mmap=True))
+
+    def _path(self, table: str) -> str:
+        return os.path.join(self.directory, f"{table}.feather")
+
+    def _read(self, table: str) -> "pd.DataFrame":
+        from pyarrow import feather
+
+        return feather.read_table(self._path(table), memory_map=True).to_pandas()
+
+    @staticmethod
+    def _select(year: int, max_id: int = None, last_year: int = None):
+        """filter of BUCHUNG_QUERY as pyarrow.dataset expression"""
+        import pyarrow.dataset as ds
+
+        datum = ds.field("datum")
+        expression = (
+            (datum >= datetime.date(year, 1, 1))
+            & (datum <= datetime.date(last_year or year, 12, 31))
+            & (ds.field("splitid").is_null() | (ds.field("splittyp") == 3))
+        )
+        if max_id is not None:
+            expression &= ds.field("id") <= max_id
+        return expression
+
+    def _frame(self, expression) -> "pd.DataFrame":
+        buchungen = self.buchung.to_table(columns=list(BUCHUNG_COLUMNS), filter=expression).to_pandas()
+        return buchungen.astype(BUCHUNG_COLUMNS).assign(buschluessel=math.nan)
+
+    def get_metadaten(self, cache_file: str = None) -> Tuple[Dict, Dict]:
+        if cache_file is not None:
+            raise ValueError("the metadata cache is validated with CHECKSUM TABLE and only works with MySQL")
+        buchungsart, konto = self._read("buchungsart"), self._read("konto")
+        buchungsarten = dict(zip(buchungsart.iloc[:, 0], buchungsart.iloc[:, 1]))
+        konto_namen = dict(zip(konto.iloc[:, 0], konto.iloc[:, 2]))
+        return buchungsarten, konto_namen
+
+    def get_buchungen(self, year: int, max_id: int = None, last_year: int = None) -> "pd.DataFrame":
+        return self._frame(self._select(year, max_id, last_year))
+
+    def iter_umsatz_gruppen(self, year: int, max_id: int = None) -> Iterator[Tuple[int, str, "pd.DataFrame"]]:
+        import pyarrow.dataset as ds
+
+        buchungen = self._frame(self._select(year, max_id) & ds.field("name").is_valid())
+        buchungen = buchungen.sort_values(["konto", "name", "id"], ignore_index=True)
+        for (konto, umsatzid), umsatz_buchungen in buchungen.groupby(["konto", "name"], sort=False):
+            yield konto, umsatzid, umsatz_buchungen.reset_index(drop=True)
+
+    def get_neue_buchungen(self, year: int, watermark_id: int, max_id: int) -> "pd.DataFrame":
+        import pandas as pd
+        import pyarrow.dataset as ds
+
+        neu = self.buchung.to_table(columns=["konto", "name"], filter=self._select(year) & (ds.field("id") > watermark_id))
+        umsaetze = pd.MultiIndex.from_frame(neu.to_pandas())
+        buchungen = self._frame(self._select(year, max_id))
+        return buchungen[pd.MultiIndex.from_frame(buchungen[["konto", "name"]]).isin(umsaetze)].reset_index(drop=True)
+
+    def get_tables(self) -> Dict[str, "pd.DataFrame"]:
+        return {table: self._read(table) for table in SNAPSHOT_TABLES}
+
+
+def write_snapshot(source: DataSource, directory: str):
+    from pyarrow import feather
+
+    os.makedirs(directory, exist_ok=True)
+    for table, frame in source.get_tables().items():
+        path = os.path.join(directory, f"{table}.feather")
+        feather.write_feather(frame, f"{path}.part")
+        os.replace(f"{path}.part", path)
+
+
+def open_datasource(
+    host: str = None,
+    user: str = None,
+    password: str = None,
+    database: str = None,
+    sqlite: str = None,
+    snapshot: str = None,
+    pool_size: int = None,
+) -> DataSource:
+    if snapshot is not None:
+        return SnapshotSource(snapshot)
+    if sqlite is not None:
+        import sqlite3
+
+        sqlite3.register_converter("DATE", lambda value: datetime.date.fromisoformat(value.decode()))
+        cnxn = sqlite3.connect(sqlite, detect_types=sqlite3.PARSE_DECLTYPES)
+        return DbApiSource(cnxn, paramstyle="qmark", dialect="sqlite")
+    if pool_size:
+        return MySQLPoolSource(host, user, password, database, pool_size)
+    return MySQLSource(host, user, password, database)
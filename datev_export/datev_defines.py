@@ -9,10 +9,16 @@ __author__ = "Vinzent Rudolf"
 __version__ = "1.0.0"
 __email__ = "v.rudolf@vfr-grossbottwar.de"
 
+import bisect
 import dataclasses
 import enum
-from datetime import date, datetime
-from typing import Union
+import warnings
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, List, Tuple, Union
+
+if TYPE_CHECKING:
+    # numpy is imported on first use by find_many
+    import numpy
 
 
 class BUSchluesselUSt(enum.Enum):
@@ -55,6 +61,71 @@ class SteuerKonto:
     """
 
 
+class IntervalIndex:
+    """
+    Sorted date intervals (both ends included) with bisect lookup.
+    Overlapping intervals raise a ValueError, gaps are reported as warning unless allow_gaps is set.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[date, date]], values: Iterable = None, name: str = "", allow_gaps=False):
+        intervals = list(intervals)
+        values = [None] * len(intervals) if values is None else list(values)
+        items = sorted(zip(intervals, values), key=lambda item: item[0])
+        self.name = name
+        self.starts = [start for (start, _), _ in items]
+        self.ends = [end for (_, end), _ in items]
+        self.values = [value for _, value in items]
+
+        for pos, (start, end) in enumerate(zip(self.starts, self.ends)):
+            if start > end:
+                raise ValueError(f"{name}: interval {start} - {end} ends before it starts")
+            if pos == 0:
+                continue
+            if start <= self.ends[pos - 1]:
+                raise ValueError(f"{name}: interval {start} - {end} overlaps {self.starts[pos - 1]} - {self.ends[pos - 1]}")
+            if not allow_gaps and start - self.ends[pos - 1] > timedelta(days=1):
+                warnings.warn(
+                    f"{name}: no interval from {self.ends[pos - 1] + timedelta(days=1)} to {start - timedelta(days=1)}"
+                )
+
+    def items(self) -> Iterator[Tuple[date, date, Any]]:
+        return zip(self.starts, self.ends, self.values)
+
+    def find(self, day: date) -> int:
+        """position of the interval containing day or -1"""
+        pos = bisect.bisect_right(self.starts, day) - 1
+        if pos >= 0 and day <= self.ends[pos]:
+            return pos
+        return -1
+
+    def find_many(self, days) -> "numpy.ndarray":
+        """positions of the intervals containing each of days or -1, for a whole column of dates at once"""
+        import numpy
+
+        days = numpy.asarray(days, dtype="datetime64[D]")
+        starts = numpy.array(self.starts, dtype="datetime64[D]")
+        ends = numpy.array(self.ends, dtype="datetime64[D]")
+        pos = numpy.searchsorted(starts, days, side="right") - 1
+        covered = (pos >= 0) & (days <= ends[pos.clip(0)])
+        return numpy.where(covered, pos, -1)
+
+    def __contains__(self, day: date) -> bool:
+        return self.find(day) >= 0
+
+    def lookup(self, day: date):
+        pos = self.find(day)
+        if pos < 0:
+            raise KeyError(f"{self.name}: {day} is not covered")
+        return self.values[pos]
+
+    def last_end_before(self, day: date) -> date:
+        """end of the last interval ending before day"""
+        pos = bisect.bisect_left(self.ends, day) - 1
+        if pos < 0:
+            raise KeyError(f"{self.name}: no interval ends before {day}")
+        return self.ends[pos]
+
+
 BU_UST_MAPPING = {
     (date(2007, 1, 1), date(2020, 6, 30)): {
         BUSchluesselUSt.k0: 1,
@@ -100,18 +171,44 @@ BU_VST_MAPPING = {
 }
 
 
-def get_bu_schluessel(buchung_date: date, key: Union[BUSchluesselUSt, BUSchluesselVSt]):
+BU_UST_INDEX = IntervalIndex(BU_UST_MAPPING.keys(), BU_UST_MAPPING.values(), "BU_UST_MAPPING")
+BU_VST_INDEX = IntervalIndex(BU_VST_MAPPING.keys(), BU_VST_MAPPING.values(), "BU_VST_MAPPING")
+
+
+def get_bu_index(key: Union[BUSchluesselUSt, BUSchluesselVSt]) -> IntervalIndex:
     if isinstance(key, BUSchluesselUSt):
-        active_date = next(filter(lambda date_range: date_range[0] <= buchung_date <= date_range[1], BU_UST_MAPPING.keys()))
-        return BU_UST_MAPPING[active_date][key]
+        return BU_UST_INDEX
     elif isinstance(key, BUSchluesselVSt):
-        active_date = next(filter(lambda date_range: date_range[0] <= buchung_date <= date_range[1], BU_VST_MAPPING.keys()))
-        return BU_VST_MAPPING[active_date][key]
+        return BU_VST_INDEX
     else:
         raise ValueError
 
 
-def get_datev_header(year: int, debug: bool = False) -> Union[dict, list]:
+def get_bu_schluessel(buchung_date: date, key: Union[BUSchluesselUSt, BUSchluesselVSt]):
+    return get_bu_index(key).lookup(buchung_date)[key]
+
+
+def check_steuer_konten(steuer_konten: List[SteuerKonto]):
+    """
+    Every date a SteuerKonto is used must be covered by a BU mapping which knows its BU-Schlüssel,
+    otherwise get_bu_schluessel fails for Buchungen on this date.
+    """
+    for steuer_konto in steuer_konten:
+        index = get_bu_index(steuer_konto.buschluessel)
+        for start, end in steuer_konto.used_daterange:
+            for mapping_start, mapping_end, mapping in index.items():
+                if mapping_start <= end and start <= mapping_end and steuer_konto.buschluessel not in mapping:
+                    warnings.warn(
+                        f"{steuer_konto.jverein_konto_name}: used from {max(start, mapping_start)} to {min(end, mapping_end)}, "
+                        f"but {steuer_konto.buschluessel} has no BU-Schlüssel in this period"
+                    )
+
+
+def get_datev_header(
+    year: int, debug: bool = False, berater: int = 123, mandant: int = 321, periode: Tuple[date, date] = None
+) -> Union[dict, list]:
+    # period of the Buchungsstapel, the whole year unless it is exported per month or quarter
+    periode_start, periode_ende = periode if periode is not None else (date(year, 1, 1), date(year, 12, 31))
     header = {
         1: {"value": "EXTF", "descr": "Kennzeichen"},
         2: {"value": "700", "descr": "Versionsnummer"},
@@ -126,19 +223,19 @@ def get_datev_header(year: int, debug: bool = False) -> Union[dict, list]:
         8: {"value": "", "descr": "reserviert (Leerfeld)"},
         9: {"value": "", "descr": "reserviert (Leerfeld)"},
         10: {"value": "", "descr": "reserviert (Leerfeld)"},
-        11: {"value": "123", "descr": "Beraternummer"},
-        12: {"value": "321", "descr": "Mandantennummer"},
+        11: {"value": str(berater), "descr": "Beraternummer"},
+        12: {"value": str(mandant), "descr": "Mandantennummer"},
         13: {
             "value": date(year, 1, 1).strftime("%Y%m%d"),
             "descr": "Wirtschaftsjahresbeginn (Format: YYYYMMDD)",
         },
         14: {"value": "4", "descr": "Nummernlänge der Sachkonten"},
         15: {
-            "value": date(year, 1, 1).strftime("%Y%m%d"),
+            "value": periode_start.strftime("%Y%m%d"),
             "descr": "Beginn der Periode des Stapels (YYYYMMDD)",
         },
         16: {
-            "value": date(year, 12, 31).strftime("%Y%m%d"),
+            "value": periode_ende.strftime("%Y%m%d"),
             "descr": "Ende der Periode des Stapels (YYYYMMDD)",
         },
         17: {"value": "", "descr": "Bezeichnung des Stapels"},
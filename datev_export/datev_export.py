@@ -9,174 +9,914 @@ __author__ = "Vinzent Rudolf"
 __version__ = "1.0.0"
 __email__ = "v.rudolf@vfr-grossbottwar.de"
 
-import csv
-import datetime
-import math
-from typing import Dict, List, Union
-
-import mysql.connector
-import pandas as pd
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import itertools
+import operator
+import os
+import warnings
+import zipfile
+from datetime import date, timedelta
+from typing import IO, TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from datev_export.datev_defines import (
+    BU_UST_MAPPING,
+    BU_VST_MAPPING,
     BUSchluesselUSt,
     BUSchluesselVSt,
+    IntervalIndex,
     KontoMapping,
     SteuerKonto,
+    get_bu_index,
     get_bu_schluessel,
     get_datev_column_names,
     get_datev_header,
 )
+from datev_export.check import check_metadaten, check_umsaetze, summarize
+from datev_export.datasource import Buchung, DataSource, GepaarteBuchung, get_konto_namen, open_datasource
+from datev_export.datev_record import DatevRecord
+from datev_export.datev_writer import DATEV_ENCODING, DatevWriter, get_compression
+from datev_export.kontenplan import Kontenplan
+from datev_export.parquet_writer import DatevParquetWriter
+from datev_export.profiling import get_profiler
+from datev_export.steuer_matching import NettoIndex
+from datev_export.watermark import Watermark, get_config_hash, load_watermark, save_watermark
+
+if TYPE_CHECKING:
+    # pandas (and numpy) are only imported by the loop and vectorized engines, the tuple engine works without them
+    import pandas as pd
 
 KONTO_MAPPING: List[KontoMapping]
 JVEREIN_STEUER_KONTEN: List[SteuerKonto]
 from datev_export.custom_defines import JVEREIN_STEUER_KONTEN, KONTO_MAPPING
 
+USE_LEISTUNGSAUSGLEICH = True
+DEBITOREN_KONTO = 9999
+KREDITOREN_KONTO = 99999
 
-def get_steuer_konto_from_key(key: Union[BUSchluesselUSt, BUSchluesselVSt]):
-    return next(filter(lambda x: x.buschluessel == key, JVEREIN_STEUER_KONTEN))
+KONTENPLAN = Kontenplan(KONTO_MAPPING, JVEREIN_STEUER_KONTEN)
 
+# Umsätze per task when converting in a process pool
+UMSATZ_BATCH_SIZE = 200
+# Umsätze converted at once by the vectorized engine
+VECTORIZED_CHUNK_SIZE = 5000
 
-def get_jverein_steuer_konten(buchungsarten: Dict):
-    inv_buchungsarten = {v: k for k, v in buchungsarten.items()}
-    return {inv_buchungsarten[x.jverein_konto_nr]: x for x in JVEREIN_STEUER_KONTEN}
 
+def get_steuer_konto_from_key(key: Union[BUSchluesselUSt, BUSchluesselVSt]):
+    return KONTENPLAN.get_steuer_konto(key)
 
-def get_buchungen(crsr, year: int) -> pd.DataFrame:
-    crsr: mysql.connector.connection_cext.CMySQLCursor
-    start_date = datetime.date(year, 1, 1)
-    end_date = datetime.date(year, 12, 31)
-
-    # fetch all Buchungen
-    crsr.execute(
-        f"SELECT * FROM buchung WHERE datum >= '{start_date.strftime('%Y-%m-%d')}' AND datum <= '{end_date.strftime('%Y-%m-%d')}'"
-    )
-    buchungen = pd.DataFrame([list(row) for row in crsr.fetchall()])
 
-    # fetch column names
-    crsr.execute("SHOW COLUMNS FROM jverein.buchung")
-    buchungen.columns = [column[0] for column in crsr.fetchall()]
-    buchungen = buchungen[buchungen["splitid"].isna() | (buchungen["splittyp"] == 3)]
-    return buchungen.assign(buschluessel=math.nan)
+def get_jverein_steuer_konten(buchungsarten: Dict):
+    return KONTENPLAN.get_jverein_steuer_konten(buchungsarten)
 
 
-def get_buchungsarten(crsr) -> Dict:
-    crsr: mysql.connector.connection_cext.CMySQLCursor
-    crsr.execute(f"SELECT * FROM buchungsart")
-    buchungsarten = {col[0]: col[1] for col in crsr.fetchall()}
-    return buchungsarten
+def get_konten(crsr) -> Dict:
+    return KONTENPLAN.get_konten(get_konto_namen(crsr))
+
+
+def split_steuer_buchungen(umsatz_buchungen: "pd.DataFrame", jverein_steuer_konten: Dict):
+    netto_index = NettoIndex(umsatz_buchungen.index, umsatz_buchungen["betrag"], umsatz_buchungen["zweck"])
+    steuer_buchungen = umsatz_buchungen[umsatz_buchungen["buchungsart"].isin(jverein_steuer_konten.keys())]
+    steuer_buchung: pd.Series
+    for _, steuer_buchung in steuer_buchungen.iterrows():
+        steuer_konto = jverein_steuer_konten[steuer_buchung["buchungsart"]]
+        netto_buchung = netto_index.candidates(steuer_buchung["betrag"], steuer_buchung["zweck"], steuer_konto.steuersatz)
+        if len(netto_buchung) == 0:
+            raise IOError(f"Cannot find corresponding netto Buchung:\n{steuer_buchung}\n{umsatz_buchungen}")
+        elif len(netto_buchung) > 1:
+            raise IOError(f"Netto Buchung is not unique:\n{steuer_buchung}\n{umsatz_buchungen}")
+        id = netto_buchung[0]
+        netto_index.mark_used(id)
+
+        netto_buchung = umsatz_buchungen.loc[id]
+        brutto = round(netto_buchung["betrag"] + steuer_buchung["betrag"], 2)
+        umsatz_buchungen.loc[id, "betrag"] = brutto
+        umsatz_buchungen.loc[id, "buschluessel"] = steuer_konto.buschluessel
+
+
+def build_records(
+    konto: int,
+    umsatzid: str,
+    betrag: float,
+    buchungsart: int,
+    datum: date,
+    zweck: str,
+    buschluessel: Union[BUSchluesselUSt, BUSchluesselVSt, None],
+    buchungsarten: Dict,
+    konten: Dict,
+    buchung_id: int = None,
+) -> Tuple[DatevRecord, Optional[DatevRecord]]:
+    """DATEV row of one (brutto) Buchung and its Leistungsausgleich row, if it needs one"""
+    new_buchung = DatevRecord(buchung_id=buchung_id, betrag=betrag)
+    new_buchung["Umsatz"] = f"{abs(betrag)}".replace(".", ",")
+    new_buchung["WKZ Umsatz"] = "EUR"
+    leistung_ausgleich = None
+
+    if betrag >= 0:
+        new_buchung["Konto"] = buchungsarten[buchungsart]
+        new_buchung["Gegenkonto (ohne BU-Schlüssel)"] = konten[konto]
+    else:
+        new_buchung["Konto"] = konten[konto]
+        new_buchung["Gegenkonto (ohne BU-Schlüssel)"] = buchungsarten[buchungsart]
+
+    new_buchung["Belegdatum"] = datum.strftime("%d%m")
+    new_buchung["Belegfeld 1"] = int(umsatzid)
+    new_buchung["Buchungstext"] = zweck.replace("\r", "").replace("\n", "")
+
+    if buschluessel is not None:
+        new_buchung["BU-Schlüssel"] = get_bu_schluessel(datum, buschluessel)
+        used_daterange = KONTENPLAN.used_daterange[buschluessel]
+        if datum not in used_daterange:
+            get_profiler().count("leistungsausgleich")
+            leistung_ausgleich = new_buchung.copy()
+            leistung_ausgleich.ausgleich = True
+            leistung_ausgleich["Buchungstext"] = "Ausgleich - " + leistung_ausgleich["Buchungstext"]
+
+            # use last date for "Leistungsdatum"
+            leistung_date = used_daterange.last_end_before(datum)
+            new_buchung["BU-Schlüssel"] = get_bu_schluessel(leistung_date, buschluessel)
+            new_buchung["Leistungsdatum"] = leistung_date.strftime("%d%m%Y")
+            new_buchung["Datum Zuord. Steuerperiode"] = datum.strftime("%d%m%Y")
+            if USE_LEISTUNGSAUSGLEICH:
+                if betrag >= 0:
+                    leistung_ausgleich["Gegenkonto (ohne BU-Schlüssel)"] = konten[konto]
+                    leistung_ausgleich["Konto"] = KREDITOREN_KONTO
+                    new_buchung["Gegenkonto (ohne BU-Schlüssel)"] = KREDITOREN_KONTO
+                else:
+                    leistung_ausgleich["Konto"] = konten[konto]
+                    leistung_ausgleich["Gegenkonto (ohne BU-Schlüssel)"] = DEBITOREN_KONTO
+                    new_buchung["Konto"] = DEBITOREN_KONTO
+
+    if not USE_LEISTUNGSAUSGLEICH:
+        leistung_ausgleich = None
+    return new_buchung, leistung_ausgleich
+
+
+def convert_umsatz(
+    konto: int,
+    umsatzid: str,
+    umsatz_buchungen: "pd.DataFrame",
+    buchungsarten: Dict,
+    konten: Dict,
+    jverein_steuer_konten: Dict,
+) -> Iterator[DatevRecord]:
+    profiler = get_profiler()
+    buchung: pd.Series
+    # check if we split for taxes
+    with profiler.stage("steuer_split"):
+        split_steuer_buchungen(umsatz_buchungen, jverein_steuer_konten)
+
+    # timed per Umsatz, the rows are handed on after the stage so the writer is not part of it
+    with profiler.stage("row_build") as stats:
+        records = []
+        for _, buchung in filter(
+            lambda x: x[1]["buchungsart"] not in jverein_steuer_konten.keys() and x[1]["betrag"] != 0,
+            umsatz_buchungen.iterrows(),
+        ):
+            new_buchung, leistung_ausgleich = build_records(
+                konto,
+                umsatzid,
+                buchung["betrag"],
+                buchung["buchungsart"],
+                buchung["datum"],
+                buchung["zweck"],
+                None if buchung[["buschluessel"]].isna().all() else buchung["buschluessel"],
+                buchungsarten,
+                konten,
+                int(buchung["id"]),
+            )
+            records.append(new_buchung)
+            if leistung_ausgleich is not None:
+                records.append(leistung_ausgleich)
+        stats.rows += len(records)
+    yield from records
+
+
+def split_steuer_tupel(umsatz_buchungen: List[Buchung], jverein_steuer_konten: Dict) -> Tuple[List[float], List]:
+    """same as split_steuer_buchungen for Buchung tuples: brutto betrag and BU-Schlüssel of every Buchung"""
+    betraege = [buchung.betrag for buchung in umsatz_buchungen]
+    buschluessel = [None] * len(umsatz_buchungen)
+    netto_index = NettoIndex(range(len(umsatz_buchungen)), betraege, [buchung.zweck for buchung in umsatz_buchungen])
+    for steuer_buchung in umsatz_buchungen:
+        if steuer_buchung.buchungsart not in jverein_steuer_konten:
+            continue
+        steuer_konto = jverein_steuer_konten[steuer_buchung.buchungsart]
+        netto_buchung = netto_index.candidates(steuer_buchung.betrag, steuer_buchung.zweck, steuer_konto.steuersatz)
+        if len(netto_buchung) == 0:
+            raise IOError(f"Cannot find corresponding netto Buchung:\n{steuer_buchung}\n{umsatz_buchungen}")
+        elif len(netto_buchung) > 1:
+            raise IOError(f"Netto Buchung is not unique:\n{steuer_buchung}\n{umsatz_buchungen}")
+        pos = netto_buchung[0]
+        netto_index.mark_used(pos)
+
+        betraege[pos] = round(betraege[pos] + steuer_buchung.betrag, 2)
+        buschluessel[pos] = steuer_konto.buschluessel
+    return betraege, buschluessel
+
+
+def convert_umsatz_tupel(
+    konto: int,
+    umsatzid: str,
+    umsatz_buchungen: List[Buchung],
+    buchungsarten: Dict,
+    konten: Dict,
+    jverein_steuer_konten: Dict,
+) -> Iterator[DatevRecord]:
+    profiler = get_profiler()
+    with profiler.stage("steuer_split"):
+        betraege, buschluessel = split_steuer_tupel(umsatz_buchungen, jverein_steuer_konten)
+
+    with profiler.stage("row_build") as stats:
+        records = []
+        for buchung, betrag, key in zip(umsatz_buchungen, betraege, buschluessel):
+            if buchung.buchungsart in jverein_steuer_konten or betrag == 0:
+                continue
+            new_buchung, leistung_ausgleich = build_records(
+                konto,
+                umsatzid,
+                betrag,
+                buchung.buchungsart,
+                buchung.datum,
+                buchung.zweck,
+                key,
+                buchungsarten,
+                konten,
+                buchung.id,
+            )
+            records.append(new_buchung)
+            if leistung_ausgleich is not None:
+                records.append(leistung_ausgleich)
+        stats.rows += len(records)
+    yield from records
+
+
+def convert_buchungen_sql(
+    umsaetze: Iterable[Tuple[int, str, List[Union[GepaarteBuchung, Buchung]]]],
+    buchungsarten: Dict,
+    konten: Dict,
+    jverein_steuer_konten: Dict,
+) -> Iterator[DatevRecord]:
+    """
+    Umsätze of DataSource.get_gepaarte_umsaetze: netto Buchungen already paired in the database are converted directly,
+    Umsätze the database left open (plain Buchung tuples) are split like in the tuple engine
+    """
+    profiler = get_profiler()
+    for konto, umsatzid, umsatz_buchungen in umsaetze:
+        if not umsatz_buchungen or not isinstance(umsatz_buchungen[0], GepaarteBuchung):
+            yield from convert_umsatz_tupel(konto, umsatzid, umsatz_buchungen, buchungsarten, konten, jverein_steuer_konten)
+            continue
+        with profiler.stage("row_build") as stats:
+            records = []
+            for buchung in umsatz_buchungen:
+                if buchung.betrag == 0:
+                    continue
+                new_buchung, leistung_ausgleich = build_records(
+                    konto,
+                    umsatzid,
+                    buchung.betrag,
+                    buchung.buchungsart,
+                    buchung.datum,
+                    buchung.zweck,
+                    buchung.buschluessel,
+                    buchungsarten,
+                    konten,
+                    buchung.id,
+                )
+                records.append(new_buchung)
+                if leistung_ausgleich is not None:
+                    records.append(leistung_ausgleich)
+            stats.rows += len(records)
+        yield from records
+
+
+def iter_umsaetze_tupel(buchungen: Iterable[Buchung]) -> Iterator[Tuple[int, str, List[Buchung]]]:
+    """same Umsätze in the same order as iter_umsaetze, without pandas"""
+    umsatz_key = operator.attrgetter("konto", "name")
+    buchungen = sorted((buchung for buchung in buchungen if buchung.name is not None), key=umsatz_key)
+    for (konto, umsatzid), umsatz_buchungen in itertools.groupby(buchungen, umsatz_key):
+        yield konto, umsatzid, list(umsatz_buchungen)
+
+
+def convert_buchungen_tupel(
+    umsaetze: Iterable[Tuple[int, str, List[Buchung]]], buchungsarten: Dict, konten: Dict, jverein_steuer_konten: Dict
+) -> Iterator[DatevRecord]:
+    for konto, umsatzid, umsatz_buchungen in umsaetze:
+        yield from convert_umsatz_tupel(konto, umsatzid, umsatz_buchungen, buchungsarten, konten, jverein_steuer_konten)
+
+
+def iter_umsaetze(buchungen: "pd.DataFrame") -> Iterator[Tuple[int, str, "pd.DataFrame"]]:
+    for konto, konto_buchungen in buchungen.groupby(["konto"]):
+        umsatz_buchungen: "pd.DataFrame"
+        for umsatzid, umsatz_buchungen in konto_buchungen.groupby("name"):
+            yield konto, umsatzid, umsatz_buchungen
+
+
+def convert_buchungen(
+    umsaetze: Iterable[Tuple[int, str, "pd.DataFrame"]], buchungsarten: Dict, konten: Dict, jverein_steuer_konten: Dict
+) -> Iterator[DatevRecord]:
+    for konto, umsatzid, umsatz_buchungen in umsaetze:
+        yield from convert_umsatz(konto, umsatzid, umsatz_buchungen, buchungsarten, konten, jverein_steuer_konten)
+
+
+def build_records_vectorized(
+    buchungen: "pd.DataFrame", buchungsarten: Dict, konten: Dict, jverein_steuer_konten: Dict
+) -> Iterator[DatevRecord]:
+    """
+    Same rows as convert_umsatz, but every field is computed as a column operation over all given Buchungen.
+    buchungen must already be split by split_steuer_buchungen and ordered by Umsatz.
+    """
+    import numpy as np
+    import pandas as pd
+
+    buchungen = buchungen[~buchungen["buchungsart"].isin(jverein_steuer_konten.keys()) & (buchungen["betrag"] != 0)]
+    if buchungen.empty:
+        return
+
+    buchungsart_konten = buchungen["buchungsart"].map(buchungsarten)
+    if buchungsart_konten.isna().any():
+        raise KeyError(f"Unknown Buchungsart: {sorted(set(buchungen['buchungsart'][buchungsart_konten.isna()]))}")
+    jverein_konten = buchungen["konto"].map(konten)
+    if jverein_konten.isna().any():
+        raise KeyError(f"Unknown Konto: {sorted(set(buchungen['konto'][jverein_konten.isna()]))}")
+
+    betrag = buchungen["betrag"].to_numpy()
+    positiv = betrag >= 0
+    konto = np.where(positiv, buchungsart_konten, jverein_konten)
+    gegenkonto = np.where(positiv, jverein_konten, buchungsart_konten)
+    umsatz = pd.Series(np.abs(betrag)).astype(str).str.replace(".", ",", regex=False)
+    datum = buchungen["datum"].to_numpy()
+    belegdatum = pd.to_datetime(buchungen["datum"]).dt.strftime("%d%m")
+    belegfeld = buchungen["name"].astype("int64")
+    buchungstext = buchungen["zweck"].str.replace("\r", "", regex=False).str.replace("\n", "", regex=False)
+
+    # BU-Schlüssel and the Buchungen outside the period their Steuerkonto is used in, per BU-Schlüssel
+    bu_schluessel = np.full(len(buchungen), "", dtype=object)
+    ausgleich_bu_schluessel = np.full(len(buchungen), "", dtype=object)
+    leistungsdatum = np.full(len(buchungen), "", dtype=object)
+    ausgleich = np.zeros(len(buchungen), dtype=bool)
+    keys = buchungen["buschluessel"].to_numpy()
+    has_key = pd.notna(keys)
+    for key in set(keys[has_key]):
+        rows = np.flatnonzero(has_key & (keys == key))
+        bu_index = get_bu_index(key)
+        pos = bu_index.find_many(datum[rows])
+        if (pos < 0).any():
+            raise KeyError(f"{bu_index.name}: {datum[rows][pos < 0][0]} is not covered")
+        bu_schluessel[rows] = [bu_index.values[p][key] for p in pos]
+
+        inactive = KONTENPLAN.used_daterange[key].find_many(datum[rows]) < 0
+        rows_inactive = rows[inactive]
+        ausgleich[rows_inactive] = True
+        ausgleich_bu_schluessel[rows_inactive] = bu_schluessel[rows_inactive]
+        leistung_dates = [KONTENPLAN.used_daterange[key].last_end_before(day) for day in datum[rows_inactive]]
+        bu_schluessel[rows_inactive] = [get_bu_schluessel(day, key) for day in leistung_dates]
+        leistungsdatum[rows_inactive] = [day.strftime("%d%m%Y") for day in leistung_dates]
+
+    if USE_LEISTUNGSAUSGLEICH:
+        ausgleich_konto = np.where(positiv, KREDITOREN_KONTO, jverein_konten)
+        ausgleich_gegenkonto = np.where(positiv, jverein_konten, DEBITOREN_KONTO)
+        konto = np.where(ausgleich & ~positiv, DEBITOREN_KONTO, konto)
+        gegenkonto = np.where(ausgleich & positiv, KREDITOREN_KONTO, gegenkonto)
+
+    columns = zip(
+        buchungen["id"].tolist(),
+        betrag.tolist(),
+        umsatz.tolist(),
+        konto.tolist(),
+        gegenkonto.tolist(),
+        belegdatum.tolist(),
+        belegfeld.tolist(),
+        buchungstext.tolist(),
+        bu_schluessel,
+        leistungsdatum,
+        ausgleich.tolist(),
+        datum,
+    )
+    for pos, row in enumerate(columns):
+        id, brutto, umsatz, konto, gegenkonto, belegdatum, belegfeld, text, bu, leistung, is_ausgleich, day = row
+        record = DatevRecord(buchung_id=id, betrag=brutto)
+        record["Umsatz"] = umsatz
+        record["WKZ Umsatz"] = "EUR"
+        record["Konto"] = konto
+        record["Gegenkonto (ohne BU-Schlüssel)"] = gegenkonto
+        record["Belegdatum"] = belegdatum
+        record["Belegfeld 1"] = belegfeld
+        record["Buchungstext"] = text
+        if bu != "":
+            record["BU-Schlüssel"] = bu
+        if is_ausgleich:
+            record["Leistungsdatum"] = leistung
+            record["Datum Zuord. Steuerperiode"] = day.strftime("%d%m%Y")
+        yield record
+
+        if is_ausgleich and USE_LEISTUNGSAUSGLEICH:
+            record = DatevRecord(buchung_id=id, betrag=brutto, ausgleich=True)
+            record["Umsatz"] = umsatz
+            record["WKZ Umsatz"] = "EUR"
+            record["Konto"] = ausgleich_konto[pos].item()
+            record["Gegenkonto (ohne BU-Schlüssel)"] = ausgleich_gegenkonto[pos].item()
+            record["Belegdatum"] = belegdatum
+            record["Belegfeld 1"] = belegfeld
+            record["Buchungstext"] = "Ausgleich - " + text
+            record["BU-Schlüssel"] = ausgleich_bu_schluessel[pos]
+            yield record
+
+
+def convert_buchungen_vectorized(
+    umsaetze: Iterable[Tuple[int, str, "pd.DataFrame"]],
+    buchungsarten: Dict,
+    konten: Dict,
+    jverein_steuer_konten: Dict,
+    chunk_size: int = VECTORIZED_CHUNK_SIZE,
+) -> Iterator[DatevRecord]:
+    """same rows as convert_buchungen, the Umsätze are split one by one and converted in chunks of chunk_size"""
+    import pandas as pd
+
+    profiler = get_profiler()
+    umsaetze = iter(umsaetze)
+    for chunk in iter(lambda: list(itertools.islice(umsaetze, chunk_size)), []):
+        with profiler.stage("steuer_split"):
+            for _, _, umsatz_buchungen in chunk:
+                split_steuer_buchungen(umsatz_buchungen, jverein_steuer_konten)
+        with profiler.stage("row_build") as stats:
+            records = list(
+                build_records_vectorized(
+                    pd.concat([umsatz_buchungen for _, _, umsatz_buchungen in chunk]),
+                    buchungsarten,
+                    konten,
+                    jverein_steuer_konten,
+                )
+            )
+            stats.rows += len(records)
+        yield from records
+
+
+def convert_buchungen_parallel(
+    umsaetze: Iterable[Tuple[int, str, "pd.DataFrame"]],
+    buchungsarten: Dict,
+    konten: Dict,
+    jverein_steuer_konten: Dict,
+    workers: int,
+    batch_size: int = UMSATZ_BATCH_SIZE,
+    engine: str = "loop",
+) -> Iterator[DatevRecord]:
+    """
+    Converts batches of Umsätze in a process pool. Results are collected in submission order,
+    so the rows come out exactly as in convert_buchungen. At most 2 * workers batches are in flight.
+    """
+    convert = functools.partial(
+        _convert_batch,
+        buchungsarten=buchungsarten,
+        konten=konten,
+        jverein_steuer_konten=jverein_steuer_konten,
+        engine=engine,
+    )
+    umsaetze = iter(umsaetze)
+    batches = iter(lambda: list(itertools.islice(umsaetze, batch_size)), [])
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(convert, batch))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _convert_batch(
+    umsaetze: List[Tuple[int, str, "pd.DataFrame"]],
+    buchungsarten: Dict,
+    konten: Dict,
+    jverein_steuer_konten: Dict,
+    engine: str = "loop",
+) -> List[DatevRecord]:
+    return list(ENGINES[engine](umsaetze, buchungsarten, konten, jverein_steuer_konten))
+
+
+# row builders, "loop" converts Buchung by Buchung, "vectorized" whole chunks of Umsätze as column operations,
+# "tuple" works on plain Buchung tuples without pandas (quick start and little memory for small exports),
+# "sql" is the tuple engine with the Steuerbuchungen paired in the database (full exports of SQL sources)
+ENGINES = {
+    "loop": convert_buchungen,
+    "vectorized": convert_buchungen_vectorized,
+    "tuple": convert_buchungen_tupel,
+    "sql": convert_buchungen_sql,
+}
+
+
+def set_config(config):
+    """
+    Use KONTO_MAPPING and JVEREIN_STEUER_KONTEN of another config module (same layout as custom_defines)
+    for the following exports, e.g. when exporting several clubs in one process.
+    """
+    global KONTO_MAPPING, JVEREIN_STEUER_KONTEN, KONTENPLAN
+    KONTENPLAN = Kontenplan(config.KONTO_MAPPING, config.JVEREIN_STEUER_KONTEN)
+    KONTO_MAPPING = config.KONTO_MAPPING
+    JVEREIN_STEUER_KONTEN = config.JVEREIN_STEUER_KONTEN
+
+
+def get_perioden(year: int, shard: str) -> List[Tuple[str, date, date]]:
+    """(name, start, end) of every Buchungsstapel when a year is sharded by month or quarter"""
+    months = {"month": 1, "quarter": 3}[shard]
+    perioden = []
+    for start_month in range(1, 13, months):
+        start = date(year, start_month, 1)
+        end = date(year, start_month + months, 1) - timedelta(days=1) if start_month + months <= 12 else date(year, 12, 31)
+        name = f"{year}-{start_month:02d}" if shard == "month" else f"{year}-Q{start_month // 3 + 1}"
+        perioden.append((name, start, end))
+    return perioden
+
+
+def get_umsatz_daterange(umsatz_buchungen: Union["pd.DataFrame", List[Buchung]]) -> Tuple[date, date]:
+    if isinstance(umsatz_buchungen, list):
+        daten = [buchung.datum for buchung in umsatz_buchungen]
+    else:
+        daten = umsatz_buchungen["datum"]
+    return min(daten), max(daten)
+
+
+def shard_umsaetze(
+    umsaetze: Iterable[Tuple[int, str, Union["pd.DataFrame", List[Buchung]]]], perioden: List[Tuple[str, date, date]]
+) -> List[List[Tuple]]:
+    """
+    Umsätze per period, in their original order. An Umsatz belongs to the period of its first Buchung,
+    the parts of a split Umsatz have to stay together to find their Steuerbuchungen.
+    """
+    index = IntervalIndex([(start, end) for _, start, end in perioden], name="Perioden")
+    shards = [[] for _ in perioden]
+    for umsatz in umsaetze:
+        konto, umsatzid, umsatz_buchungen = umsatz
+        erster, letzter = get_umsatz_daterange(umsatz_buchungen)
+        pos = index.find(erster)
+        if pos != index.find(letzter):
+            warnings.warn(f"Umsatz {umsatzid} (Konto {konto}) spans periods, exported in {perioden[pos][0]}")
+        shards[pos].append(umsatz)
+    return shards
+
+
+def write_stapel(
+    output: str,
+    header: List,
+    umsaetze: List[Tuple],
+    buchungsarten: Dict,
+    konten: Dict,
+    jverein_steuer_konten: Dict,
+    engine: str = "loop",
+    encoding: str = DATEV_ENCODING,
+    verify: bool = False,
+) -> int:
+    """writes one Buchungsstapel, returns the number of booking rows"""
+    with DatevWriter(output, header, get_datev_column_names(), encoding=encoding, verify=verify) as writer:
+        writer.writerows(ENGINES[engine](umsaetze, buchungsarten, konten, jverein_steuer_konten))
+    return writer.rows
+
+
+def export_shards(
+    year: int,
+    umsaetze: Iterable[Tuple],
+    buchungsarten: Dict,
+    konten: Dict,
+    jverein_steuer_konten: Dict,
+    shard: str,
+    output_dir: str = None,
+    bundle: str = None,
+    workers: int = 1,
+    engine: str = "loop",
+    berater: int = 123,
+    mandant: int = 321,
+    encoding: str = DATEV_ENCODING,
+    verify: bool = False,
+) -> List[str]:
+    """
+    One Buchungsstapel per month or quarter with the period in its header, written as
+    <output_dir>/datev_export_<year>-<MM|Qn>.csv. With workers > 1 the periods are converted
+    and written concurrently. bundle additionally packs all files into one ZIP archive.
+    """
+    perioden = get_perioden(year, shard)
+    outputs = [os.path.join(output_dir or "", f"datev_export_{name}.csv") for name, _, _ in perioden]
+    headers = [get_datev_header(year, berater=berater, mandant=mandant, periode=(start, end)) for _, start, end in perioden]
+    shards = shard_umsaetze(umsaetze, perioden)
+    convert = functools.partial(
+        write_stapel,
+        buchungsarten=buchungsarten,
+        konten=konten,
+        jverein_steuer_konten=jverein_steuer_konten,
+        engine=engine,
+        encoding=encoding,
+        verify=verify,
+    )
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(convert, outputs, headers, shards))
+    else:
+        rows = [convert(output, header, umsaetze) for output, header, umsaetze in zip(outputs, headers, shards)]
+    get_profiler().count("write", sum(rows))
+
+    if bundle is not None:
+        with zipfile.ZipFile(f"{bundle}.part", "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for output in outputs:
+                archive.write(output, arcname=os.path.basename(output))
+        os.replace(f"{bundle}.part", bundle)
+    return outputs
+
+
+def split_years(buchungen: Union["pd.DataFrame", List[Buchung]], years: List[int]) -> Dict[int, Union["pd.DataFrame", List]]:
+    """Buchungen of several years per year of their datum, the same rows a query of every single year returns"""
+    if isinstance(buchungen, list):
+        per_year = {year: [] for year in years}
+        for buchung in buchungen:
+            if buchung.datum.year in per_year:
+                per_year[buchung.datum.year].append(buchung)
+        return per_year
+    buchung_years = buchungen["datum"].map(operator.attrgetter("year"))
+    return {year: buchungen[buchung_years == year].reset_index(drop=True) for year in years}
+
+
+def export_years(
+    years: List[int],
+    host: str = None,
+    user: str = None,
+    password: str = None,
+    database: str = None,
+    output_dir: str = None,
+    workers: int = 1,
+    metadata_cache: str = None,
+    sqlite: str = None,
+    snapshot: str = None,
+    pool_size: int = None,
+    source: DataSource = None,
+    engine: str = "loop",
+    berater: int = 123,
+    mandant: int = 321,
+    encoding: str = DATEV_ENCODING,
+    verify: bool = False,
+) -> List[str]:
+    """
+    One Buchungsstapel per year for several years, written as <output_dir>/datev_export_<year>.csv with the
+    Wirtschaftsjahresbeginn of its year. The Buchungen of all years are fetched with one query and the metadata
+    is read once; with workers > 1 the years are converted and written concurrently.
+    The sql engine pairs the Steuerbuchungen per year in the database, here it converts like the tuple engine.
+    """
+    if source is None:
+        source = open_datasource(host, user, password, database, sqlite=sqlite, snapshot=snapshot, pool_size=pool_size)
+    profiler = get_profiler()
+    years = sorted(set(years))
+    tupel = engine in ("tuple", "sql")
+
+    with profiler.stage("fetch") as stats:
+        (buchungsarten, konto_namen), buchungen = source.get_export_daten(
+            years[0], None, metadata_cache, tupel, last_year=years[-1]
+        )
+        stats.rows += len(buchungen)
+    with profiler.stage("metadata"):
+        konten = KONTENPLAN.get_konten(konto_namen)
+        jverein_steuer_konten = get_jverein_steuer_konten(buchungsarten)
+    with profiler.stage("grouping"):
+        iter_year = iter_umsaetze_tupel if tupel else iter_umsaetze
+        umsaetze = [list(iter_year(year_buchungen)) for year_buchungen in split_years(buchungen, years).values()]
+    del buchungen
+
+    outputs = [os.path.join(output_dir or "", f"datev_export_{year}.csv") for year in years]
+    headers = [get_datev_header(year, berater=berater, mandant=mandant) for year in years]
+    convert = functools.partial(
+        write_stapel,
+        buchungsarten=buchungsarten,
+        konten=konten,
+        jverein_steuer_konten=jverein_steuer_konten,
+        engine=engine,
+        encoding=encoding,
+        verify=verify,
+    )
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with profiler.stage("write") as stats:
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(years))) as executor:
+                rows = list(executor.map(convert, outputs, headers, umsaetze))
+        else:
+            rows = [
+                convert(output, header, year_umsaetze) for output, header, year_umsaetze in zip(outputs, headers, umsaetze)
+            ]
+        stats.rows += sum(rows)
+    return outputs
+
+
+def get_export_config_hash() -> str:
+    return get_config_hash(
+        KONTO_MAPPING,
+        JVEREIN_STEUER_KONTEN,
+        BU_UST_MAPPING,
+        BU_VST_MAPPING,
+        USE_LEISTUNGSAUSGLEICH,
+        DEBITOREN_KONTO,
+        KREDITOREN_KONTO,
+    )
 
 
-def get_konten(crsr) -> Dict:
-    crsr: mysql.connector.connection_cext.CMySQLCursor
-    crsr.execute(f"SELECT * FROM konto")
-    konten = {col[0]: col[2] for col in crsr.fetchall()}
-    # KONTO_MAPPING: list[KontoMapping]
-    return {
-        id: next(filter(lambda x: x.jverein_konto_name == name, KONTO_MAPPING)).datev_konto_nr for id, name in konten.items()
-    }
-
-
-def main(year: int, host: str, user: str, password: str, database: str):
-    cnxn: mysql.connector.CMySQLConnection
-    cnxn = mysql.connector.connect(host=host, user=user, password=password, database=database)
-    crsr: mysql.connector.connection_cext.CMySQLCursor
-    crsr = cnxn.cursor()
-    buchungen = get_buchungen(crsr, year)
-    buchungsarten = get_buchungsarten(crsr)
-    konten = get_konten(crsr)
-    jverein_steuer_konten = get_jverein_steuer_konten(buchungsarten)
-
-    use_leistungsausgleich = True
-    debitoren_konto = 9999
-    kreditoren_konto = 99999
+def get_stapel_output(output: Union[str, IO], stapel: int) -> Union[str, IO]:
+    """
+    file name of a follow-up Buchungsstapel of an incremental export: the number is appended to the name of the
+    full export, e.g. export_2.csv or export_2.csv.gz, stdout and opened files are written to as they are
+    """
+    if not isinstance(output, str) or output == "-":
+        return output
+    compression = get_compression(output)
+    root = output[: -len(compression) - 1] if compression else output
+    root, ext = os.path.splitext(root)
+    return f"{root}_{stapel}{ext}.{compression}" if compression else f"{root}_{stapel}{ext}"
+
+
+def check(
+    year: int,
+    host: str = None,
+    user: str = None,
+    password: str = None,
+    database: str = None,
+    metadata_cache: str = None,
+    sqlite: str = None,
+    snapshot: str = None,
+    pool_size: int = None,
+    source: DataSource = None,
+    engine: str = None,
+) -> Dict:
+    """
+    Pre-flight check of a whole year: fetches the Buchungen once and reports every problem the export
+    would stop at (see check.check_umsaetze) instead of raising on the first one.
+    For the sql engine "offene_steuer" lists the Steuerbuchungen the database cannot pair unambiguously,
+    their Umsätze are paired in Python (see datasource.get_steuer_paare_query).
+    """
+    if source is None:
+        source = open_datasource(host, user, password, database, sqlite=sqlite, snapshot=snapshot, pool_size=pool_size)
+    profiler = get_profiler()
+    with profiler.stage("fetch") as stats:
+        (buchungsarten, konto_namen), buchungen = source.get_export_daten(year, None, metadata_cache, tupel=True)
+        stats.rows += len(buchungen)
+    with profiler.stage("check"):
+        umsaetze = iter_umsaetze_tupel(buchungen)
+        problems = check_umsaetze(umsaetze, buchungsarten, konto_namen, KONTENPLAN, USE_LEISTUNGSAUSGLEICH)
+    report = {"year": year, "buchungen": len(buchungen), "summary": summarize(problems), "problems": problems}
+    if engine == "sql":
+        with profiler.stage("sql"):
+            _, _, jverein_steuer_konten = check_metadaten(buchungsarten, konto_namen, KONTENPLAN)
+            report["offene_steuer"] = source.get_offene_steuer_buchungen(year, None, jverein_steuer_konten)
+    return report
+
+
+def main(
+    year: int,
+    host: str = None,
+    user: str = None,
+    password: str = None,
+    database: str = None,
+    output: Union[str, IO] = None,
+    stream: bool = False,
+    workers: int = 1,
+    incremental: bool = False,
+    state_file: str = None,
+    metadata_cache: str = None,
+    sqlite: str = None,
+    snapshot: str = None,
+    pool_size: int = None,
+    source: DataSource = None,
+    engine: str = "loop",
+    berater: int = 123,
+    mandant: int = 321,
+    shard: str = None,
+    bundle: str = None,
+    encoding: str = DATEV_ENCODING,
+    verify: bool = False,
+    parquet: str = None,
+):
+    """
+    shard: "month" or "quarter" writes one Buchungsstapel per period instead of one per year,
+    output is then the directory of the files and bundle an optional ZIP archive of all of them.
+    An output file name ending with .gz or .zip is compressed, verify checks the written file line by line.
+    parquet: directory the converted Buchungen are additionally written to as Parquet dataset per month.
+    """
+    if shard is not None and (incremental or output == "-"):
+        raise ValueError("a sharded export cannot be incremental or written to stdout")
+    if parquet is not None and (shard is not None or incremental):
+        raise ValueError("the Parquet output is only written for a full export of the year")
+    if source is None:
+        source = open_datasource(host, user, password, database, sqlite=sqlite, snapshot=snapshot, pool_size=pool_size)
+    profiler = get_profiler()
 
     # DATEV Header
-    header = get_datev_header(year)
+    header = get_datev_header(year, berater=berater, mandant=mandant)
     columns = get_datev_column_names()
-    datev_buchungen = [header, columns]
-    output_file = f"datev_export_{year}.csv"
 
-    for konto, konto_buchungen in buchungen.groupby(["konto"]):
-        umsatz_buchungen: pd.DataFrame
-        for umsatzid, umsatz_buchungen in konto_buchungen.groupby("name"):
-            buchung: pd.Series
-            # check if we split for taxes
-            for _, steuer_buchung in filter(
-                lambda x: x[1]["buchungsart"] in jverein_steuer_konten.keys(),
-                umsatz_buchungen.iterrows(),
-            ):
-                steuer_konto = jverein_steuer_konten[steuer_buchung["buchungsart"]]
-
-                def find_netto_buchung(buchung: pd.Series):
-                    steuer = round(buchung["betrag"] * steuer_konto.steuersatz / 100, 2)
-                    steuer_fits = (
-                        (steuer == steuer_buchung["betrag"])
-                        or (steuer == round(steuer_buchung["betrag"] + 0.01, 2))
-                        or (steuer == round(steuer_buchung["betrag"] - 0.01, 2))
-                    )
-                    zweck_fits = steuer_buchung["zweck"].startswith(buchung["zweck"])
-                    not_used = buchung[["buschluessel"]].isna().all()
-                    return steuer_fits and zweck_fits and not_used
-
-                netto_buchung = list(filter(lambda x: find_netto_buchung(x[1]), umsatz_buchungen.iterrows()))
-                if len(netto_buchung) == 0:
-                    raise IOError(f"Cannot find corresponding netto Buchung:\n{steuer_buchung}\n{umsatz_buchungen}")
-                elif len(netto_buchung) > 1:
-                    raise IOError(f"Netto Buchung is not unique:\n{steuer_buchung}\n{umsatz_buchungen}")
-                id = netto_buchung[0][0]
-
-                netto_buchung = umsatz_buchungen.loc[id]
-                brutto = round(netto_buchung["betrag"] + steuer_buchung["betrag"], 2)
-                umsatz_buchungen.loc[id, "betrag"] = brutto
-                umsatz_buchungen.loc[id, "buschluessel"] = steuer_konto.buschluessel
-
-            for _, buchung in filter(
-                lambda x: x[1]["buchungsart"] not in jverein_steuer_konten.keys() and x[1]["betrag"] != 0,
-                umsatz_buchungen.iterrows(),
-            ):
-                new_buchung = {col: "" for col in columns}
-                new_buchung["Umsatz"] = f"{abs(buchung['betrag'])}".replace(".", ",")
-                new_buchung["WKZ Umsatz"] = "EUR"
-                leistung_ausgleich = None
-
-                if buchung["betrag"] >= 0:
-                    new_buchung["Konto"] = buchungsarten[buchung["buchungsart"]]
-                    new_buchung["Gegenkonto (ohne BU-Schlüssel)"] = konten[konto]
-                else:
-                    new_buchung["Konto"] = konten[konto]
-                    new_buchung["Gegenkonto (ohne BU-Schlüssel)"] = buchungsarten[buchung["buchungsart"]]
-
-                new_buchung["Belegdatum"] = buchung["datum"].strftime("%d%m")
-                new_buchung["Belegfeld 1"] = int(umsatzid)
-                new_buchung["Buchungstext"] = buchung["zweck"].replace("\r", "").replace("\n", "")
-
-                if not buchung[["buschluessel"]].isna().all():
-                    new_buchung["BU-Schlüssel"] = get_bu_schluessel(buchung["datum"], buchung["buschluessel"])
-                    steuer_konto = get_steuer_konto_from_key(buchung["buschluessel"])
-                    is_active = any(filter(lambda x: x[0] <= buchung["datum"] <= x[1], steuer_konto.used_daterange))
-                    if not is_active:
-                        leistung_ausgleich = new_buchung.copy()
-                        leistung_ausgleich["Buchungstext"] = "Ausgleich - " + leistung_ausgleich["Buchungstext"]
-
-                        # use last date for "Leistungsdatum"
-                        leistung_date = list(filter(lambda x: x[1] < buchung["datum"], steuer_konto.used_daterange))[-1][1]
-                        new_buchung["BU-Schlüssel"] = get_bu_schluessel(leistung_date, buchung["buschluessel"])
-                        new_buchung["Leistungsdatum"] = leistung_date.strftime("%d%m%Y")
-                        new_buchung["Datum Zuord. Steuerperiode"] = buchung["datum"].strftime("%d%m%Y")
-                        if use_leistungsausgleich:
-                            if buchung["betrag"] >= 0:
-                                leistung_ausgleich["Gegenkonto (ohne BU-Schlüssel)"] = konten[konto]
-                                leistung_ausgleich["Konto"] = kreditoren_konto
-                                new_buchung["Gegenkonto (ohne BU-Schlüssel)"] = kreditoren_konto
-                            else:
-                                leistung_ausgleich["Konto"] = konten[konto]
-                                leistung_ausgleich["Gegenkonto (ohne BU-Schlüssel)"] = debitoren_konto
-                                new_buchung["Konto"] = debitoren_konto
-
-                datev_buchungen.append(list(new_buchung.values()))
-                if use_leistungsausgleich and leistung_ausgleich:
-                    datev_buchungen.append(list(leistung_ausgleich.values()))
-
-    with open(output_file, "w", newline="") as f:
-        writer = csv.writer(f, delimiter=";")
-        writer.writerows(datev_buchungen)
+    tupel = engine in ("tuple", "sql")
+    max_id = None
+    if incremental:
+        if state_file is None:
+            state_file = f"datev_export_{year}.state.json"
+        config_hash = get_export_config_hash()
+        stand = source.get_buchung_stand(year)
+        # everything up to this id is exported, Buchungen added meanwhile are left for the next run
+        max_id = stand.max_id
+        watermark = load_watermark(state_file)
+        neue_buchungen = None
+        if (
+            watermark is not None
+            and watermark.year == year
+            and watermark.config_hash == config_hash
+            and source.get_buchung_stand(year, watermark.stand.max_id) == watermark.stand
+        ):
+            if tupel:
+                neue_buchungen = source.get_neue_buchung_tupel(year, watermark.stand.max_id, max_id)
+                veraendert = any(buchung.id <= watermark.stand.max_id for buchung in neue_buchungen)
+            else:
+                neue_buchungen = source.get_neue_buchungen(year, watermark.stand.max_id, max_id)
+                veraendert = (neue_buchungen["id"] <= watermark.stand.max_id).any()
+            if veraendert:
+                # an already exported Umsatz got new Buchungen
+                neue_buchungen = None
+
+        if neue_buchungen is not None:
+            if len(neue_buchungen) == 0:
+                return
+            with profiler.stage("metadata"):
+                buchungsarten, konto_namen = source.get_metadaten(metadata_cache)
+                konten = KONTENPLAN.get_konten(konto_namen)
+                jverein_steuer_konten = get_jverein_steuer_konten(buchungsarten)
+            stapel = watermark.stapel + 1
+            output = get_stapel_output(f"datev_export_{year}.csv" if output is None else output, stapel)
+            umsaetze = iter_umsaetze_tupel(neue_buchungen) if tupel else iter_umsaetze(neue_buchungen)
+            umsaetze = profiler.iterate("grouping", umsaetze)
+            datev_buchungen = ENGINES[engine](umsaetze, buchungsarten, konten, jverein_steuer_konten)
+            with profiler.stage("write") as stats:
+                with DatevWriter(output, header, columns, encoding=encoding, verify=verify) as writer:
+                    writer.writerows(datev_buchungen)
+                stats.rows += writer.rows
+            save_watermark(state_file, Watermark(year, config_hash, stand, stapel))
+            return
+
+    if output is None and shard is None:
+        output = f"datev_export_{year}.csv"
+
+    if engine == "sql" and not stream:
+        # the Steuerkonten are part of the query, so the metadata comes first
+        with profiler.stage("metadata"):
+            buchungsarten, konto_namen = source.get_metadaten(metadata_cache)
+        with profiler.stage("fetch") as stats:
+            umsaetze = source.get_gepaarte_umsaetze(year, max_id, get_jverein_steuer_konten(buchungsarten))
+            stats.rows += len(umsaetze)
+    elif stream:
+        # fetch metadata first, the unbuffered cursor is busy until the last Umsatz is read
+        with profiler.stage("metadata"):
+            buchungsarten, konto_namen = source.get_metadaten(metadata_cache)
+        umsaetze = source.iter_umsatz_tupel(year, max_id) if tupel else source.iter_umsatz_gruppen(year, max_id)
+        umsaetze = profiler.iterate("fetch", umsaetze)
+    else:
+        # with a connection pool the metadata is fetched concurrently and part of this stage
+        with profiler.stage("fetch") as stats:
+            (buchungsarten, konto_namen), buchungen = source.get_export_daten(year, max_id, metadata_cache, tupel)
+            stats.rows += len(buchungen)
+        umsaetze = iter_umsaetze_tupel(buchungen) if tupel else iter_umsaetze(buchungen)
+        umsaetze = profiler.iterate("grouping", umsaetze)
+    with profiler.stage("metadata"):
+        konten = KONTENPLAN.get_konten(konto_namen)
+        jverein_steuer_konten = get_jverein_steuer_konten(buchungsarten)
+
+    if shard is not None:
+        with profiler.stage("write"):
+            export_shards(
+                year,
+                umsaetze,
+                buchungsarten,
+                konten,
+                jverein_steuer_konten,
+                shard,
+                output,
+                bundle,
+                workers,
+                engine,
+                berater,
+                mandant,
+                encoding,
+                verify,
+            )
+        return
+
+    if workers > 1:
+        datev_buchungen = convert_buchungen_parallel(
+            umsaetze, buchungsarten, konten, jverein_steuer_konten, workers, engine=engine
+        )
+    else:
+        datev_buchungen = ENGINES[engine](umsaetze, buchungsarten, konten, jverein_steuer_konten)
+
+    with profiler.stage("write") as stats:
+        with contextlib.ExitStack() as stack:
+            # the Parquet dataset is only kept when the DATEV file was written (and verified) as well
+            if parquet is not None:
+                datev_buchungen = stack.enter_context(DatevParquetWriter(parquet, year)).tee(datev_buchungen)
+            writer = stack.enter_context(DatevWriter(output, header, columns, encoding=encoding, verify=verify))
+            writer.writerows(datev_buchungen)
+        stats.rows += writer.rows
+
+    if incremental:
+        save_watermark(state_file, Watermark(year, config_hash, stand))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+datev_record.py: Kompakte Darstellung einer Buchungszeile, nur die befüllten Felder werden gespeichert
+Format: https://developer.datev.de/portal/de/dtvf/formate
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+from typing import Any, Dict, Iterator, List
+
+from datev_export.datev_defines import get_datev_column_names
+
+DATEV_COLUMNS: List[str] = get_datev_column_names()
+COLUMN_INDEX: Dict[str, int] = {name: pos for pos, name in enumerate(DATEV_COLUMNS)}
+EMPTY_ROW: List[str] = [""] * len(DATEV_COLUMNS)
+
+
+class DatevRecord:
+    """
+    One booking row of the Buchungsstapel. Only about 10 of the 124 columns are ever filled,
+    so only those are stored as {column index: value}. The empty fields are added by to_row()
+    when the row is written; iterating a record yields the full row, so it can be passed to
+    csv.writer directly.
+
+    buchung_id, betrag (signed brutto betrag) and ausgleich (Leistungsausgleich row) describe where the
+    row comes from, they are not part of the DATEV row.
+    """
+
+    __slots__ = ("fields", "buchung_id", "betrag", "ausgleich")
+
+    def __init__(self, fields: Dict[int, Any] = None, buchung_id: int = None, betrag: float = None, ausgleich: bool = False):
+        self.fields = {} if fields is None else fields
+        self.buchung_id = buchung_id
+        self.betrag = betrag
+        self.ausgleich = ausgleich
+
+    def __setitem__(self, column: str, value: Any):
+        self.fields[COLUMN_INDEX[column]] = value
+
+    def __getitem__(self, column: str) -> Any:
+        return self.fields.get(COLUMN_INDEX[column], "")
+
+    def copy(self) -> "DatevRecord":
+        return DatevRecord(self.fields.copy(), self.buchung_id, self.betrag, self.ausgleich)
+
+    def to_row(self) -> List:
+        row = EMPTY_ROW.copy()
+        for pos, value in self.fields.items():
+            row[pos] = value
+        return row
+
+    def __iter__(self) -> Iterator:
+        return iter(self.to_row())
+
+    def __len__(self) -> int:
+        return len(EMPTY_ROW)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, DatevRecord):
+            other = other.to_row()
+        return self.to_row() == other
+
+    def __repr__(self) -> str:
+        return f"DatevRecord({ {DATEV_COLUMNS[pos]: value for pos, value in sorted(self.fields.items())} })"
+
+    # __slots__ classes without __dict__ need explicit pickle support for the worker processes
+    def __getstate__(self):
+        return self.fields, self.buchung_id, self.betrag, self.ausgleich
+
+    def __setstate__(self, state):
+        self.fields, self.buchung_id, self.betrag, self.ausgleich = state
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+datev_writer.py: Schreibt einen Datev Buchungsstapel zeilenweise in eine Datei, nach stdout oder in eine Pipe
+Format: https://developer.datev.de/portal/de/dtvf/formate
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import codecs
+import csv
+import gzip
+import io
+import itertools
+import os
+import sys
+import unicodedata
+import zipfile
+from typing import IO, Iterable, List, Union
+
+BUFFER_SIZE = 1024 * 1024
+# DATEV imports Buchungsstapel as Windows-1252 (ANSI)
+DATEV_ENCODING = "cp1252"
+# rows formatted by csv.writer before the buffer size is checked
+ROW_CHUNK_SIZE = 1000
+# characters csv.writer has already quoted for, a replacement must not introduce them
+CSV_SPECIAL_CHARACTERS = set(';"\r\n')
+
+
+def replace_unencodable(error: UnicodeEncodeError):
+    """
+    Deterministic replacement for characters the DATEV encoding does not know, e.g. in Buchungstext:
+    the character without accents (NFKD) if that can be encoded, otherwise "?".
+    """
+    replacement = []
+    for character in error.object[error.start : error.end]:
+        decomposed = "".join(c for c in unicodedata.normalize("NFKD", character) if not unicodedata.combining(c))
+        try:
+            decomposed.encode(error.encoding)
+        except UnicodeEncodeError:
+            decomposed = ""
+        if not decomposed or CSV_SPECIAL_CHARACTERS.intersection(decomposed):
+            decomposed = "?"
+        replacement.append(decomposed)
+    return "".join(replacement), error.end
+
+
+codecs.register_error("datev_replace", replace_unencodable)
+
+
+def get_compression(name: str) -> str:
+    return "gz" if name.endswith(".gz") else "zip" if name.endswith(".zip") else None
+
+
+def open_binary(path: str, compression: str = None) -> IO[bytes]:
+    """reads a file written by DatevWriter, compression "gz" or "zip" (see get_compression)"""
+    if compression == "gz":
+        return gzip.open(path, "rb")
+    if compression == "zip":
+        archive = zipfile.ZipFile(path)
+        return archive.open(archive.namelist()[0])
+    return open(path, "rb")
+
+
+def verify_datev_file(path: str, columns: int, encoding: str = DATEV_ENCODING, compression: str = None) -> int:
+    """
+    Checks a written Buchungsstapel line by line: it decodes strictly in the encoding and every
+    booking row has the number of columns. Returns the number of booking rows.
+    """
+    rows = 0
+    with io.TextIOWrapper(open_binary(path, compression), encoding=encoding, errors="strict", newline="") as f:
+        try:
+            for pos, row in enumerate(csv.reader(f, delimiter=";")):
+                if pos >= 2:
+                    if len(row) != columns:
+                        raise ValueError(f"{path}: row {pos + 1} has {len(row)} instead of {columns} columns")
+                    rows += 1
+        except UnicodeDecodeError as e:
+            raise ValueError(f"{path}: is not valid {encoding}: {e.reason}") from e
+    return rows
+
+
+class DatevWriter:
+    """
+    Streaming writer for a Buchungsstapel: header and column names are written on enter,
+    the booking rows are formatted in chunks and encoded to the DATEV encoding in one go
+    once buffer_size characters are collected. Characters the encoding does not know are
+    replaced by replace_unencodable.
+
+    target can be a file name, "-" for stdout or an already opened file (e.g. a pipe). Text files
+    get the formatted text, binary files the encoded bytes. File names ending with .gz or .zip are
+    compressed on the fly. A file name is written to "<name>.part" first and only renamed when the
+    export succeeded (and with verify, when verify_datev_file passed).
+    """
+
+    def __init__(
+        self,
+        target: Union[str, IO],
+        header: List,
+        columns: List,
+        buffer_size: int = BUFFER_SIZE,
+        encoding: str = DATEV_ENCODING,
+        verify: bool = False,
+    ):
+        self.target = target
+        self.header = header
+        self.columns = columns
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.verify = verify
+        self._file: IO = None
+        self._archive: zipfile.ZipFile = None
+        self._text = io.StringIO(newline="")
+        self._writer = csv.writer(self._text, delimiter=";")
+        self._part_file: str = None
+        self.rows = 0
+
+    def __enter__(self) -> "DatevWriter":
+        if self.target == "-":
+            self._file = open(sys.stdout.fileno(), "wb", buffering=self.buffer_size, closefd=False)
+        elif isinstance(self.target, str):
+            self._part_file = f"{self.target}.part"
+            compression = get_compression(self.target)
+            if compression == "gz":
+                self._file = gzip.open(self._part_file, "wb")
+            elif compression == "zip":
+                self._archive = zipfile.ZipFile(self._part_file, "w", compression=zipfile.ZIP_DEFLATED)
+                member = os.path.basename(self.target)[: -len(".zip")]
+                self._file = self._archive.open(member if member.endswith(".csv") else f"{member}.csv", "w")
+            else:
+                self._file = open(self._part_file, "wb", buffering=self.buffer_size)
+        else:
+            self._file = self.target
+        self._writer.writerow(self.header)
+        self._writer.writerow(self.columns)
+        return self
+
+    def _flush(self):
+        text = self._text.getvalue()
+        self._text.seek(0)
+        self._text.truncate()
+        if isinstance(self._file, io.TextIOBase):
+            self._file.write(text)
+        else:
+            self._file.write(text.encode(self.encoding, errors="datev_replace"))
+
+    def writerow(self, row: List):
+        self._writer.writerow(row)
+        self.rows += 1
+        if self._text.tell() >= self.buffer_size:
+            self._flush()
+
+    def writerows(self, rows: Iterable[List]):
+        rows = iter(rows)
+        for chunk in iter(lambda: list(itertools.islice(rows, ROW_CHUNK_SIZE)), []):
+            self._writer.writerows(chunk)
+            self.rows += len(chunk)
+            if self._text.tell() >= self.buffer_size:
+                self._flush()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self._flush()
+        if self._file is self.target:
+            self._file.flush()
+            return
+        self._file.close()
+        if self._archive is not None:
+            self._archive.close()
+        if self._part_file is not None:
+            if exc_type is None and self.verify:
+                try:
+                    verify_datev_file(self._part_file, len(self.columns), self.encoding, get_compression(self.target))
+                except Exception:
+                    os.remove(self._part_file)
+                    raise
+            if exc_type is None:
+                os.replace(self._part_file, self.target)
+            else:
+                os.remove(self._part_file)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""
+diff.py: Vergleicht zwei Datev Buchungsstapel Beleg für Beleg (Belegfeld 1)
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import io
+import os
+import tempfile
+import zlib
+from typing import Dict, Iterator, List, Tuple
+
+from datev_export.datev_record import COLUMN_INDEX, DATEV_COLUMNS
+from datev_export.datev_writer import DATEV_ENCODING, get_compression, open_binary
+
+# temporary files each export is split into, a bucket of both exports is compared in memory
+DIFF_BUCKETS = 64
+BELEGFELD = COLUMN_INDEX["Belegfeld 1"]
+# header field "erzeugt am", different in every export
+HEADER_TIMESTAMP = 5
+
+
+def read_datev_rows(path: str, encoding: str = DATEV_ENCODING) -> Tuple[List[str], Iterator[List[str]]]:
+    """header and a streaming iterator over the booking rows of a (possibly compressed) Buchungsstapel"""
+    f = io.TextIOWrapper(open_binary(path, get_compression(path)), encoding=encoding, newline="")
+    rows = csv.reader(f, delimiter=";")
+    header = next(rows)
+    next(rows)
+
+    def iter_rows():
+        with f:
+            yield from rows
+
+    return header, iter_rows()
+
+
+def partition(rows: Iterator[List[str]], directory: str, buckets: int = DIFF_BUCKETS) -> List[str]:
+    """writes the rows to bucket files by a stable hash of Belegfeld 1, all rows of a Beleg end up in one bucket"""
+    paths = [os.path.join(directory, f"{pos}.csv") for pos in range(buckets)]
+    with contextlib.ExitStack() as stack:
+        writers = [
+            csv.writer(stack.enter_context(open(path, "w", encoding="utf-8", newline="")), delimiter=";") for path in paths
+        ]
+        for row in rows:
+            belegfeld = row[BELEGFELD] if len(row) > BELEGFELD else ""
+            writers[zlib.crc32(belegfeld.encode()) % buckets].writerow(row)
+    return paths
+
+
+def read_bucket(path: str) -> Dict[str, collections.Counter]:
+    belege: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f, delimiter=";"):
+            belege[row[BELEGFELD] if len(row) > BELEGFELD else ""][tuple(row)] += 1
+    return belege
+
+
+def row_fields(row: Tuple[str, ...]) -> Dict[str, str]:
+    """the filled columns of a row"""
+    return {DATEV_COLUMNS[pos]: value for pos, value in enumerate(row) if value != "" and pos < len(DATEV_COLUMNS)}
+
+
+def diff_bucket(old_path: str, new_path: str) -> List[Dict]:
+    """differences of one bucket, sorted by Belegfeld 1; runs in a worker process of diff_datev_files"""
+    old, new = read_bucket(old_path), read_bucket(new_path)
+    differences = []
+    for belegfeld in sorted(old.keys() | new.keys(), key=lambda x: (len(x), x)):
+        old_rows, new_rows = old.get(belegfeld, collections.Counter()), new.get(belegfeld, collections.Counter())
+        if old_rows == new_rows:
+            continue
+        removed = list((old_rows - new_rows).elements())
+        added = list((new_rows - old_rows).elements())
+        status = "added" if not old_rows else "removed" if not new_rows else "changed"
+        difference = {
+            "belegfeld": belegfeld,
+            "status": status,
+            "removed": [row_fields(row) for row in removed],
+            "added": [row_fields(row) for row in added],
+        }
+        if len(removed) == len(added) == 1:
+            alt, neu = row_fields(removed[0]), row_fields(added[0])
+            difference["fields"] = {
+                column: [alt.get(column, ""), neu.get(column, "")]
+                for column in DATEV_COLUMNS
+                if alt.get(column, "") != neu.get(column, "")
+            }
+        differences.append(difference)
+    return differences
+
+
+def diff_headers(old_header: List[str], new_header: List[str]) -> Dict[str, List[str]]:
+    """differing header fields (1-based like get_datev_header), without the creation time"""
+    length = max(len(old_header), len(new_header))
+    old_header, new_header = (header + [""] * (length - len(header)) for header in (old_header, new_header))
+    return {
+        str(pos + 1): [alt, neu]
+        for pos, (alt, neu) in enumerate(zip(old_header, new_header))
+        if pos != HEADER_TIMESTAMP and alt != neu
+    }
+
+
+def diff_datev_files(
+    old: str, new: str, workers: int = 1, buckets: int = DIFF_BUCKETS, encoding: str = DATEV_ENCODING
+) -> Iterator[Dict]:
+    """
+    Differences between two Buchungsstapel keyed by Belegfeld 1 (the Umsatz): Belege only in new are "added",
+    only in old "removed", with different rows "changed". The rows of a Beleg are compared as a multiset,
+    their order does not matter. A differing header is reported first with status "header".
+
+    Both files are streamed into buckets files in a temporary directory, so memory only depends on the
+    size of one bucket; with workers > 1 the buckets are compared concurrently.
+    """
+    with tempfile.TemporaryDirectory(prefix="datev_diff_") as directory:
+        old_header, old_rows = read_datev_rows(old, encoding)
+        new_header, new_rows = read_datev_rows(new, encoding)
+        header = diff_headers(old_header, new_header)
+        if header:
+            yield {"belegfeld": None, "status": "header", "fields": header}
+        os.makedirs(os.path.join(directory, "old"))
+        os.makedirs(os.path.join(directory, "new"))
+        old_paths = partition(old_rows, os.path.join(directory, "old"), buckets)
+        new_paths = partition(new_rows, os.path.join(directory, "new"), buckets)
+
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                for differences in executor.map(diff_bucket, old_paths, new_paths):
+                    yield from differences
+        else:
+            for old_path, new_path in zip(old_paths, new_paths):
+                yield from diff_bucket(old_path, new_path)
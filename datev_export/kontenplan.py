@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""
+kontenplan.py: Zuordnung der jverein Konten und Steuerkonten zu Datev Konten
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+from typing import Dict, List, Union
+
+from datev_export.datev_defines import (
+    BUSchluesselUSt,
+    BUSchluesselVSt,
+    IntervalIndex,
+    KontoMapping,
+    SteuerKonto,
+    check_steuer_konten,
+)
+
+
+class Kontenplan:
+    """
+    KONTO_MAPPING and JVEREIN_STEUER_KONTEN compiled into dict indexes.
+    Accounts without mapping are collected and reported together in one KeyError.
+    """
+
+    def __init__(self, konto_mapping: List[KontoMapping], steuer_konten: List[SteuerKonto]):
+        check_steuer_konten(steuer_konten)
+        self.konto_mapping = konto_mapping
+        self.steuer_konten = steuer_konten
+        self.datev_konten = {mapping.jverein_konto_name: mapping.datev_konto_nr for mapping in konto_mapping}
+        self.steuer_konten_by_key = {steuer_konto.buschluessel: steuer_konto for steuer_konto in steuer_konten}
+        self.used_daterange = {
+            steuer_konto.buschluessel: IntervalIndex(
+                steuer_konto.used_daterange, name=steuer_konto.jverein_konto_name, allow_gaps=True
+            )
+            for steuer_konto in steuer_konten
+        }
+
+    def get_steuer_konto(self, key: Union[BUSchluesselUSt, BUSchluesselVSt]) -> SteuerKonto:
+        return self.steuer_konten_by_key[key]
+
+    def get_konten(self, konto_namen: Dict) -> Dict:
+        """jverein konto id -> Datev konto nr"""
+        fehlend = sorted(set(konto_namen.values()) - set(self.datev_konten))
+        if fehlend:
+            raise KeyError(f"Konten without KONTO_MAPPING: {', '.join(map(str, fehlend))}")
+        return {id: self.datev_konten[name] for id, name in konto_namen.items()}
+
+    def get_jverein_steuer_konten(self, buchungsarten: Dict) -> Dict:
+        """jverein buchungsart id -> SteuerKonto"""
+        inv_buchungsarten = {v: k for k, v in buchungsarten.items()}
+        fehlend = [x.jverein_konto_nr for x in self.steuer_konten if x.jverein_konto_nr not in inv_buchungsarten]
+        if fehlend:
+            raise KeyError(f"JVEREIN_STEUER_KONTEN without Buchungsart: {', '.join(map(str, fehlend))}")
+        return {inv_buchungsarten[x.jverein_konto_nr]: x for x in self.steuer_konten}
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+parquet_writer.py: Schreibt die konvertierten Buchungen zusätzlich als Parquet Datensatz je Monat für Auswertungen
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import os
+import shutil
+from collections import defaultdict
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List
+
+from datev_export.datev_record import DatevRecord
+
+if TYPE_CHECKING:
+    # pyarrow is only needed for this output, like for the snapshots
+    import pyarrow.parquet as pq
+
+# rows of a month collected before they are written as one row group
+PARQUET_ROW_GROUP_SIZE = 50000
+# DATEV column -> (Parquet column, arrow type), only the columns the export fills
+PARQUET_COLUMNS = {
+    "Umsatz": ("umsatz", "float64"),
+    "WKZ Umsatz": ("wkz_umsatz", "string"),
+    "Konto": ("konto", "int64"),
+    "Gegenkonto (ohne BU-Schlüssel)": ("gegenkonto", "int64"),
+    "BU-Schlüssel": ("bu_schluessel", "int8"),
+    "Belegdatum": ("belegdatum", "date32"),
+    "Belegfeld 1": ("belegfeld_1", "int64"),
+    "Buchungstext": ("buchungstext", "string"),
+    "Leistungsdatum": ("leistungsdatum", "date32"),
+    "Datum Zuord. Steuerperiode": ("datum_zuord_steuerperiode", "date32"),
+}
+# where the row comes from, see DatevRecord
+SOURCE_COLUMNS = {"buchung_id": "int64", "betrag": "float64", "leistungsausgleich": "bool"}
+
+
+def get_parquet_schema():
+    import pyarrow as pa
+
+    fields = [(name, pa.type_for_alias(type)) for name, type in SOURCE_COLUMNS.items()]
+    fields += [(name, pa.type_for_alias(type)) for name, type in PARQUET_COLUMNS.values()]
+    return pa.schema(fields)
+
+
+def parse_datum(value: str, format: str = "%d%m%Y") -> date:
+    return datetime.strptime(value, format).date() if value else None
+
+
+class DatevParquetWriter:
+    """
+    Writes DatevRecords as a Parquet dataset partitioned by month of the Belegdatum,
+    <directory>/monat=<year>-<MM>/part-0.parquet (hive partitioning, e.g. for pyarrow.dataset or DuckDB).
+    Every month keeps its file open and gets a row group per row_group_size rows.
+    The dataset is written to "<directory>.part" and replaces directory when the export succeeded.
+    """
+
+    def __init__(self, directory: str, year: int, row_group_size: int = PARQUET_ROW_GROUP_SIZE, compression: str = "zstd"):
+        self.directory = directory
+        self.year = year
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.rows = 0
+        self._part_directory = f"{directory.rstrip(os.sep)}.part"
+        self._buffers: Dict[int, List[DatevRecord]] = defaultdict(list)
+        self._writers: Dict[int, "pq.ParquetWriter"] = {}
+        self._schema = None
+
+    def __enter__(self) -> "DatevParquetWriter":
+        self._schema = get_parquet_schema()
+        shutil.rmtree(self._part_directory, ignore_errors=True)
+        os.makedirs(self._part_directory)
+        return self
+
+    def _flush(self, month: int):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        records = self._buffers.pop(month, [])
+        if not records:
+            return
+        columns = {
+            "buchung_id": [record.buchung_id for record in records],
+            "betrag": [record.betrag for record in records],
+            "leistungsausgleich": [record.ausgleich for record in records],
+            "umsatz": [float(record["Umsatz"].replace(",", ".")) for record in records],
+            "belegdatum": [parse_datum(f"{record['Belegdatum']}{self.year}") for record in records],
+            "leistungsdatum": [parse_datum(record["Leistungsdatum"]) for record in records],
+            "datum_zuord_steuerperiode": [parse_datum(record["Datum Zuord. Steuerperiode"]) for record in records],
+        }
+        for column, (name, _) in PARQUET_COLUMNS.items():
+            if name not in columns:
+                columns[name] = [record[column] if record[column] != "" else None for record in records]
+        table = pa.Table.from_pydict(columns, schema=self._schema)
+
+        writer = self._writers.get(month)
+        if writer is None:
+            path = os.path.join(self._part_directory, f"monat={self.year}-{month:02d}")
+            os.makedirs(path)
+            writer = self._writers[month] = pq.ParquetWriter(
+                os.path.join(path, "part-0.parquet"), self._schema, compression=self.compression
+            )
+        writer.write_table(table)
+
+    def writerow(self, record: DatevRecord):
+        month = int(record["Belegdatum"][2:])
+        self._buffers[month].append(record)
+        self.rows += 1
+        if len(self._buffers[month]) >= self.row_group_size:
+            self._flush(month)
+
+    def writerows(self, records: Iterable[DatevRecord]):
+        for record in records:
+            self.writerow(record)
+
+    def tee(self, records: Iterable[DatevRecord]) -> Iterator[DatevRecord]:
+        """writes the records while passing them on, e.g. to the DatevWriter of the same export"""
+        for record in records:
+            self.writerow(record)
+            yield record
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        failed = exc_type is not None
+        try:
+            if not failed:
+                for month in sorted(self._buffers):
+                    self._flush(month)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            for writer in self._writers.values():
+                writer.close()
+            if failed:
+                shutil.rmtree(self._part_directory, ignore_errors=True)
+        if failed:
+            return
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.replace(self._part_directory, self.directory)
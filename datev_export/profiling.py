@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+profiling.py: Misst Laufzeit, Zeilen und Speicherbedarf der einzelnen Schritte des Datev Exports
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import cProfile
+import json
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, the peak RSS is not reported there
+    resource = None
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """peak resident set size of the process in MB, None where it cannot be sampled"""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageStats:
+    __slots__ = ("calls", "seconds", "inclusive_seconds", "rows", "peak_rss_mb")
+
+    def __init__(self):
+        self.calls = 0
+        # time spent in the stage itself, without nested stages
+        self.seconds = 0.0
+        self.inclusive_seconds = 0.0
+        self.rows = 0
+        # only sampled when the stage is left as the outermost stage (and not on Windows)
+        self.peak_rss_mb = None
+
+    def as_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "seconds": round(self.seconds, 4),
+            "inclusive_seconds": round(self.inclusive_seconds, 4),
+            "rows": self.rows,
+            "rows_per_sec": round(self.rows / self.seconds) if self.rows and self.seconds else None,
+            "peak_rss_mb": round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+        }
+
+
+class _Stage:
+    """context manager of Profiler.stage, a plain class as it is entered once per Umsatz"""
+
+    __slots__ = ("profiler", "name", "stats", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> StageStats:
+        profiler = self.profiler
+        self.stats = profiler.get_stats(self.name)
+        if profiler.cprofile_prefix is not None:
+            profiler._enable_cprofile(self.name)
+        profiler._nested.append(0.0)
+        self.start = time.perf_counter()
+        return self.stats
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        seconds = time.perf_counter() - self.start
+        profiler = self.profiler
+        if profiler.cprofile_prefix is not None:
+            profiler._disable_cprofile()
+        nested = profiler._nested
+        nested_seconds = nested.pop()
+        stats = self.stats
+        stats.calls += 1
+        stats.seconds += seconds - nested_seconds
+        stats.inclusive_seconds += seconds
+        if nested:
+            nested[-1] += seconds
+            return
+        peak_rss_mb = get_peak_rss_mb()
+        if peak_rss_mb is not None:
+            stats.peak_rss_mb = max(stats.peak_rss_mb or 0.0, peak_rss_mb)
+
+
+class Profiler:
+    """
+    Accumulates wall time, row counts and peak RSS per stage. Stages may be entered many times
+    (e.g. once per Umsatz) and may be nested, the time of nested stages is not counted twice.
+    The peak RSS is sampled when an outermost stage is left, nested stages report None.
+    With cprofile_prefix, every stage is additionally profiled with cProfile and written to
+    <cprofile_prefix>.<stage>.pstats. Only one cProfile can be active at a time, so the profile
+    of the enclosing stage is paused while a nested stage runs, like its time is not counted.
+    """
+
+    enabled = True
+
+    def __init__(self, cprofile_prefix: str = None):
+        self.cprofile_prefix = cprofile_prefix
+        self.stages: Dict[str, StageStats] = {}
+        self._cprofiles: Dict[str, cProfile.Profile] = {}
+        # cProfile of every open stage, only the last one is enabled
+        self._cprofile_stack: List[cProfile.Profile] = []
+        # time of nested stages, one entry per open stage
+        self._nested: List[float] = []
+        self._start = time.perf_counter()
+
+    def get_stats(self, name: str) -> StageStats:
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def _enable_cprofile(self, name: str):
+        if self._cprofile_stack:
+            self._cprofile_stack[-1].disable()
+        cprofile = self._cprofiles.get(name)
+        if cprofile is None:
+            cprofile = self._cprofiles[name] = cProfile.Profile()
+        self._cprofile_stack.append(cprofile)
+        cprofile.enable()
+
+    def _disable_cprofile(self):
+        self._cprofile_stack.pop().disable()
+        if self._cprofile_stack:
+            self._cprofile_stack[-1].enable()
+
+    def count(self, name: str, rows: int = 1):
+        """adds rows to stage name without timing it, for hooks called once per row"""
+        self.get_stats(name).rows += rows
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        """times every next() of iterable as stage name, e.g. for lazily fetched or grouped Umsätze"""
+        iterator = iter(iterable)
+        stats = self.get_stats(name)
+        nested = self._nested
+        cprofile = self.cprofile_prefix is not None
+        while True:
+            if cprofile:
+                self._enable_cprofile(name)
+            nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds = time.perf_counter() - start
+                if cprofile:
+                    self._disable_cprofile()
+                nested_seconds = nested.pop()
+                if nested:
+                    nested[-1] += seconds
+                stats.calls += 1
+                stats.seconds += seconds - nested_seconds
+                stats.inclusive_seconds += seconds
+            stats.rows += 1
+            yield item
+
+    def report(self) -> Dict:
+        return {
+            "total_seconds": round(time.perf_counter() - self._start, 4),
+            "stages": {name: stats.as_dict() for name, stats in self.stages.items()},
+        }
+
+    def write_report(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        for name, cprofile in self._cprofiles.items():
+            cprofile.dump_stats(f"{self.cprofile_prefix}.{name}.pstats")
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self) -> StageStats:
+        # a throwaway object, the rows counted into it are dropped
+        return StageStats()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class NullProfiler:
+    """default profiler, every hook is a no-op"""
+
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name: str) -> _NullStage:
+        return self._stage
+
+    def count(self, name: str, rows: int = 1):
+        pass
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterable:
+        return iterable
+
+
+PROFILER = NullProfiler()
+
+
+def enable_profiling(cprofile_prefix: str = None) -> Profiler:
+    global PROFILER
+    PROFILER = Profiler(cprofile_prefix)
+    return PROFILER
+
+
+def get_profiler():
+    return PROFILER
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+"""
+service.py: HTTP Dienst für den Datev Export mit offener Datenbankverbindung und Ergebnis-Cache
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import concurrent.futures
+import hashlib
+import http.server
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import urllib.parse
+from typing import IO, Callable, Dict, Optional, Tuple
+
+from datev_export import datev_export
+from datev_export.datasource import DataSource, open_datasource
+from datev_export.datev_writer import DATEV_ENCODING
+
+CACHE_SIZE = 1024 * 1024 * 1024
+# "2020" for the whole year, "2020-03" for a month, "2020-Q2" for a quarter
+PERIODE_FORMAT = re.compile(r"(\d{4})(?:-(\d{2})|-Q([1-4]))?")
+
+
+def parse_periode(periode: str) -> Tuple[int, Optional[str]]:
+    """year and shard ("month", "quarter" or None) of a requested period"""
+    match = PERIODE_FORMAT.fullmatch(periode)
+    if match is None or (match.group(2) is not None and not 1 <= int(match.group(2)) <= 12):
+        raise ValueError(f"invalid period {periode!r}, expected e.g. 2020, 2020-03 or 2020-Q2")
+    year, month, quarter = match.groups()
+    return int(year), "month" if month else "quarter" if quarter else None
+
+
+class ResultCache:
+    """
+    Written exports on disk, named by the hash of their cache key. Reading an entry marks it as used
+    (mtime), the least recently used entries are removed once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.csv")
+
+    def open(self, key: str) -> Optional[IO[bytes]]:
+        """the cached export or None, an opened entry can still be read when it is evicted meanwhile"""
+        with self._lock:
+            try:
+                f = open(self._path(key), "rb")
+            except FileNotFoundError:
+                return None
+            os.utime(self._path(key))
+            return f
+
+    def put(self, key: str, path: str):
+        """moves the file at path (on the same file system) into the cache"""
+        with self._lock:
+            os.replace(path, self._path(key))
+            self._evict(keep=self._path(key))
+
+    def _evict(self, keep: str):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".csv")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if size <= self.max_bytes:
+                break
+            if entry.path != keep:
+                size -= entry.stat().st_size
+                os.remove(entry.path)
+
+    def stats(self) -> Dict:
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".csv")]
+        size = sum(entry.stat().st_size for entry in entries)
+        return {"entries": len(entries), "bytes": size, "max_bytes": self.max_bytes}
+
+
+class SingleFlight:
+    """concurrent calls with the same key share the result of the first one"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, concurrent.futures.Future] = {}
+
+    def do(self, key: str, function: Callable):
+        """result of function and whether it was computed by another caller"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = concurrent.futures.Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = function()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class ExportService:
+    """
+    Keeps the data sources open and serves Buchungsstapel from a ResultCache. The cache key is the period,
+    Berater, Mandant, the Stand of the year's Buchungen (highest id, count and checksum), the metadata and
+    the export config, so a cached export is only returned while none of them changed.
+
+    Database work runs on two threads which own one connection each (SQLite connections cannot be shared):
+    one computes the cache keys, so cached exports are returned while the other one is busy exporting.
+    Exports are computed one at a time, concurrent requests for the same export share one computation.
+    """
+
+    def __init__(self, connection: Dict, cache: ResultCache, engine: str = "tuple", metadata_cache: str = None):
+        self.cache = cache
+        self.engine = engine
+        self.metadata_cache = metadata_cache
+        self.flights = SingleFlight()
+        self.counters = {"hit": 0, "miss": 0, "shared": 0}
+        self._lock = threading.Lock()
+        self._key_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="datev_stand")
+        self._export_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="datev_export")
+        self._key_source = self._key_executor.submit(open_datasource, **connection).result()
+        self._export_source = self._export_executor.submit(open_datasource, **connection).result()
+
+    def get_zustand(self, source: DataSource, year: int) -> Tuple:
+        """everything besides the requested period an export depends on"""
+        stand = source.get_buchung_stand(year)
+        metadaten = source.get_metadaten(self.metadata_cache)
+        return stand.max_id, stand.anzahl, stand.checksum, metadaten, datev_export.get_export_config_hash(), DATEV_ENCODING
+
+    @staticmethod
+    def get_cache_key(periode: str, berater: int, mandant: int, zustand: Tuple) -> str:
+        return hashlib.sha256(repr((periode, berater, mandant, zustand)).encode()).hexdigest()
+
+    def _export(self, periode: str, berater: int, mandant: int, key: str):
+        """
+        writes the export into the cache, a sharded year caches all of its periods under their own keys.
+        Buchungen added after the key was computed are part of the export, the next request gets a new key anyway.
+        """
+        year, shard = parse_periode(periode)
+        options = dict(source=self._export_source, engine=self.engine, berater=berater, mandant=mandant)
+        with tempfile.TemporaryDirectory(dir=self.cache.directory) as directory:
+            if shard is None:
+                output = os.path.join(directory, f"datev_export_{year}.csv")
+                datev_export.main(year, output=output, metadata_cache=self.metadata_cache, **options)
+                self.cache.put(key, output)
+                return
+            zustand = self.get_zustand(self._export_source, year)
+            datev_export.main(year, output=directory, shard=shard, metadata_cache=self.metadata_cache, **options)
+            for name, _, _ in datev_export.get_perioden(year, shard):
+                output = os.path.join(directory, f"datev_export_{name}.csv")
+                self.cache.put(key if name == periode else self.get_cache_key(name, berater, mandant, zustand), output)
+
+    def export(self, periode: str, berater: int, mandant: int) -> Tuple[IO[bytes], str]:
+        """opened Buchungsstapel and where it came from: "hit", "miss" or "shared" (computed for another request)"""
+        year, _ = parse_periode(periode)
+        zustand = self._key_executor.submit(self.get_zustand, self._key_source, year).result()
+        key = self.get_cache_key(periode, berater, mandant, zustand)
+        f = self.cache.open(key)
+        status = "hit"
+        if f is None:
+            _, shared = self.flights.do(
+                key, lambda: self._export_executor.submit(self._export, periode, berater, mandant, key).result()
+            )
+            status = "shared" if shared else "miss"
+            f = self.cache.open(key)
+            if f is None:
+                raise RuntimeError(f"export {periode} was evicted from the cache before it was read")
+        with self._lock:
+            self.counters[status] += 1
+        return f, status
+
+    def close(self):
+        for executor, source in [(self._key_executor, self._key_source), (self._export_executor, self._export_source)]:
+            executor.submit(source.close).result()
+            executor.shutdown()
+
+
+class ExportHandler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /export?periode=2020[&berater=123&mandant=321] returns the Buchungsstapel,
+    GET /status the cache statistics
+    """
+
+    service: ExportService
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: Dict):
+        self._send(status, json.dumps(data).encode(), "application/json")
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/status":
+            self._send_json(200, dict(self.service.counters, cache=self.service.cache.stats()))
+            return
+        if url.path != "/export":
+            self._send_json(404, {"error": f"unknown path {url.path}"})
+            return
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            periode = query.get("periode") or query["year"]
+            parse_periode(periode)
+            berater, mandant = int(query.get("berater", 123)), int(query.get("mandant", 321))
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        try:
+            f, status = self.service.export(periode, berater, mandant)
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=windows-1252")
+            self.send_header("Content-Length", str(size))
+            self.send_header("Content-Disposition", f'attachment; filename="datev_export_{periode}.csv"')
+            self.send_header("X-Datev-Cache", status)
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+
+def serve(service: ExportService, host: str = "127.0.0.1", port: int = 8080):
+    handler = type("Handler", (ExportHandler,), {"service": service})
+    with http.server.ThreadingHTTPServer((host, port), handler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            service.close()
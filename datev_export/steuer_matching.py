@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""
+steuer_matching.py: Ordnet Steuerbuchungen ihrer Netto-Buchung innerhalb eines Umsatzes zu
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Set
+
+
+def to_cent(betrag: float) -> int:
+    return int(round(betrag * 100))
+
+
+class NettoIndex:
+    """
+    Hash-Index über alle Buchungen eines Umsatzes.
+    Schlüssel ist die erwartete Steuer in Cent (je Steuersatz), eine Steuerbuchung findet ihre
+    Netto-Buchung über die Cent-Werte steuer - 1, steuer und steuer + 1 und den Präfix des Zwecks.
+    """
+
+    def __init__(self, ids: Iterable[Hashable], betraege: Iterable[float], zwecke: Iterable[str]):
+        self._ids = list(ids)
+        self._positions = {id: pos for pos, id in enumerate(self._ids)}
+        self._betraege = list(betraege)
+        self._zwecke = list(zwecke)
+        self._used: Set[int] = set()
+        self._by_steuersatz: Dict[int, Dict[int, List[int]]] = {}
+
+    def _index(self, steuersatz: int) -> Dict[int, List[int]]:
+        index = self._by_steuersatz.get(steuersatz)
+        if index is None:
+            index = defaultdict(list)
+            for pos, betrag in enumerate(self._betraege):
+                # same rounding as the booking itself: round to cents first, then compare in cents
+                index[to_cent(round(betrag * steuersatz / 100, 2))].append(pos)
+            self._by_steuersatz[steuersatz] = index
+        return index
+
+    def candidates(self, steuer_betrag: float, steuer_zweck: str, steuersatz: int) -> List[Hashable]:
+        index = self._index(steuersatz)
+        cent = to_cent(steuer_betrag)
+        positions = sorted(
+            pos
+            for key in (cent - 1, cent, cent + 1)
+            for pos in index.get(key, ())
+            if pos not in self._used and steuer_zweck.startswith(self._zwecke[pos])
+        )
+        return [self._ids[pos] for pos in positions]
+
+    def mark_used(self, id: Hashable):
+        self._used.add(self._positions[id])
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""
+validate.py: Prüft einen geschriebenen Datev Buchungsstapel (Header, Spalten und Feldformate) zeilenweise
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import collections
+import concurrent.futures
+import csv
+import dataclasses
+import os
+import re
+from datetime import date, datetime
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from datev_export.check import BUCHUNGSTEXT_LAENGE
+from datev_export.datev_defines import get_datev_column_names, get_datev_header
+from datev_export.datev_record import COLUMN_INDEX
+from datev_export.datev_writer import DATEV_ENCODING, get_compression, open_binary
+
+# bytes of an uncompressed file validated by one worker
+VALIDATE_CHUNK_SIZE = 64 * 1024 * 1024
+# problems listed per kind, the others are only counted
+MAX_EXAMPLES = 20
+
+# header fields (1-based, as in get_datev_header) which are the same in every export
+HEADER_CONSTANT_FIELDS = [1, 2, 3, 4, 5, 14, 18, 19, 20, 21, 22]
+HEADER_DATE_FIELDS = [13, 15, 16]
+# longest value DATEV accepts per column
+FIELD_LENGTHS = {"Buchungstext": BUCHUNGSTEXT_LAENGE, "Belegfeld 1": 36, "Belegfeld 2": 12}
+KONTO_COLUMNS = ["Konto", "Gegenkonto (ohne BU-Schlüssel)"]
+
+UMSATZ_FORMAT = re.compile(r"\d{1,10}(,\d{1,2})?")
+BELEGDATUM_FORMAT = re.compile(r"\d{4}")
+KONTO_FORMAT = re.compile(r"\d{1,9}")
+
+
+@dataclasses.dataclass
+class ValidationReport:
+    """number of rows and problems per kind, with the first MAX_EXAMPLES (line, message) of every kind"""
+
+    rows: int = 0
+    problems: Dict[str, int] = dataclasses.field(default_factory=collections.Counter)
+    examples: Dict[str, List[Tuple[int, str]]] = dataclasses.field(default_factory=dict)
+
+    def add(self, art: str, line: int, message: str):
+        self.problems[art] += 1
+        examples = self.examples.setdefault(art, [])
+        if len(examples) < MAX_EXAMPLES:
+            examples.append((line, message))
+
+    def merge(self, other: "ValidationReport", line_offset: int = 0):
+        self.rows += other.rows
+        for art, count in other.problems.items():
+            self.problems[art] += count
+            examples = self.examples.setdefault(art, [])
+            examples.extend((line + line_offset, message) for line, message in other.examples[art])
+            del examples[MAX_EXAMPLES:]
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    def to_dict(self) -> Dict:
+        return {"rows": self.rows, "problems": dict(self.problems), "examples": self.examples}
+
+
+def parse_datum(value: str, format: str = "%Y%m%d") -> Optional[date]:
+    try:
+        return datetime.strptime(value, format).date()
+    except ValueError:
+        return None
+
+
+def check_header(header: List[str], columns: List[str], report: ValidationReport) -> Tuple[date, date]:
+    """checks the first two lines, returns the period of the Buchungsstapel (None if it is invalid)"""
+    expected = get_datev_header(2000)
+    if len(header) != len(expected):
+        report.add("header", 1, f"header has {len(header)} instead of {len(expected)} fields")
+        header = (header + [""] * len(expected))[: len(expected)]
+    for field in HEADER_CONSTANT_FIELDS:
+        if header[field - 1] != expected[field - 1]:
+            report.add("header", 1, f"header field {field} is {header[field - 1]!r} instead of {expected[field - 1]!r}")
+    for field in [11, 12]:
+        if not header[field - 1].isdigit():
+            report.add("header", 1, f"header field {field} is no number: {header[field - 1]!r}")
+    wj_beginn, periode_start, periode_ende = (parse_datum(header[field - 1]) for field in HEADER_DATE_FIELDS)
+    for field, value in zip(HEADER_DATE_FIELDS, (wj_beginn, periode_start, periode_ende)):
+        if value is None:
+            report.add("header", 1, f"header field {field} is no date: {header[field - 1]!r}")
+    if periode_start and periode_ende and not (periode_start <= periode_ende and periode_start.year == periode_ende.year):
+        report.add("header", 1, f"period {periode_start} - {periode_ende} is not within one year")
+        periode_start = periode_ende = None
+    if columns != get_datev_column_names():
+        report.add("header", 2, "column names differ from get_datev_column_names()")
+    return periode_start, periode_ende
+
+
+def check_row(row: List[str], line: int, periode: Tuple[date, date], report: ValidationReport):
+    report.rows += 1
+    if len(row) != len(COLUMN_INDEX):
+        report.add("spalten", line, f"{len(row)} instead of {len(COLUMN_INDEX)} columns")
+        return
+    umsatz = row[COLUMN_INDEX["Umsatz"]]
+    if not UMSATZ_FORMAT.fullmatch(umsatz) or umsatz.strip("0,") == "":
+        report.add("umsatz", line, f"Umsatz {umsatz!r} is no positive amount like 1234,56")
+    belegdatum = row[COLUMN_INDEX["Belegdatum"]]
+    periode_start, periode_ende = periode
+    if not BELEGDATUM_FORMAT.fullmatch(belegdatum):
+        report.add("belegdatum", line, f"Belegdatum {belegdatum!r} is not TTMM")
+    elif periode_start is not None:
+        datum = parse_datum(f"{belegdatum}{periode_start.year}", "%d%m%Y")
+        if datum is None or not periode_start <= datum <= periode_ende:
+            report.add("belegdatum", line, f"Belegdatum {belegdatum} is not within {periode_start} - {periode_ende}")
+    for column in KONTO_COLUMNS:
+        if not KONTO_FORMAT.fullmatch(row[COLUMN_INDEX[column]]):
+            report.add("konto", line, f"{column} {row[COLUMN_INDEX[column]]!r} is no Kontonummer")
+    for column, length in FIELD_LENGTHS.items():
+        value = row[COLUMN_INDEX[column]]
+        if len(value) > length:
+            report.add("laenge", line, f"{column} has {len(value)} instead of at most {length} characters")
+
+
+def decode_lines(lines: Iterable[bytes], encoding: str, first_line: int, report: ValidationReport) -> Iterator[str]:
+    for line, data in enumerate(lines, first_line):
+        try:
+            yield data.decode(encoding)
+        except UnicodeDecodeError as e:
+            report.add("encoding", line, str(e))
+            yield data.decode(encoding, errors="replace")
+
+
+def validate_lines(
+    lines: Iterable[bytes], first_line: int, periode: Tuple[date, date], encoding: str = DATEV_ENCODING
+) -> ValidationReport:
+    """validates booking rows, one row per line (the export removes line breaks from the Buchungstext)"""
+    report = ValidationReport()
+    rows = csv.reader(decode_lines(lines, encoding, first_line, report), delimiter=";")
+    for line, row in enumerate(rows, first_line):
+        check_row(row, line, periode, report)
+    return report
+
+
+def iter_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    """the lines starting within the bytes [start, end) of the file"""
+    with open(path, "rb") as f:
+        f.seek(start - 1)
+        if f.read(1) != b"\n":
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+
+def _validate_range(
+    path: str, start: int, end: int, periode: Tuple[date, date], encoding: str
+) -> Tuple[int, ValidationReport]:
+    """runs in a worker process, returns the number of lines (to number the lines of the next range) and the report"""
+    lines = 0
+
+    def counted():
+        nonlocal lines
+        for line in iter_range(path, start, end):
+            lines += 1
+            yield line
+
+    report = validate_lines(counted(), 1, periode, encoding)
+    return lines, report
+
+
+def read_header(f: IO[bytes], encoding: str) -> Tuple[List[str], List[str]]:
+    header, columns = (next(csv.reader([f.readline().decode(encoding, errors="replace")], delimiter=";")) for _ in range(2))
+    return header, columns
+
+
+def validate_datev_file(
+    path: str, workers: int = 1, encoding: str = DATEV_ENCODING, chunk_size: int = VALIDATE_CHUNK_SIZE
+) -> ValidationReport:
+    """
+    Validates a Buchungsstapel line by line in constant memory. Uncompressed files are split into
+    chunks of chunk_size bytes at line boundaries and validated by workers processes,
+    .gz and .zip files (see get_compression) are read as one stream.
+    """
+    compression = get_compression(path)
+    report = ValidationReport()
+    with open_binary(path, compression) as f:
+        header, columns = read_header(f, encoding)
+        periode = check_header(header, columns, report)
+        if compression is not None or workers <= 1:
+            report.merge(validate_lines(f, 3, periode, encoding))
+            return report
+        data_start = f.tell()
+
+    size = os.path.getsize(path)
+    starts = list(range(data_start, size, chunk_size))
+    ends = starts[1:] + [size]
+    line_offset = 2
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            _validate_range, [path] * len(starts), starts, ends, [periode] * len(starts), [encoding] * len(starts)
+        )
+        for lines, chunk_report in results:
+            report.merge(chunk_report, line_offset)
+            line_offset += lines
+    return report
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+watermark.py: Merkt sich den Stand des letzten Exports für einen inkrementellen Datev Export
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import dataclasses
+import datetime
+import hashlib
+import json
+import os
+import zlib
+from typing import Optional, Sequence
+
+
+@dataclasses.dataclass
+class BuchungStand:
+    max_id: int
+    anzahl: int
+    checksum: str
+
+
+@dataclasses.dataclass
+class Watermark:
+    year: int
+    config_hash: str
+    stand: BuchungStand
+    # number of follow-up Buchungsstapel written after the last full export
+    stapel: int = 0
+
+
+def get_config_hash(*config) -> str:
+    return hashlib.sha256(repr(config).encode()).hexdigest()
+
+
+def get_buchung_stand(crsr, query: str, params: tuple) -> BuchungStand:
+    """
+    Stand of the exported Buchungen: highest id, row count and a checksum over all columns,
+    so edits or deletions of already exported Buchungen are noticed.
+    query is the export query, it is wrapped as a subquery.
+    """
+    crsr.execute(
+        "SELECT MAX(id), COUNT(*), "
+        "BIT_XOR(CRC32(CONCAT_WS('|', id, konto, name, betrag, zweck, datum, buchungsart))) "
+        f"FROM ({query}) AS exportiert",
+        params,
+    )
+    max_id, anzahl, checksum = crsr.fetchone()
+    return BuchungStand(max_id or 0, anzahl, str(checksum))
+
+
+def get_buchung_stand_from_rows(buchungen: Sequence[tuple]) -> BuchungStand:
+    """
+    same as get_buchung_stand for sources without SQL, computed from the exported Buchungen
+    as rows of (id, konto, name, betrag, zweck, datum, buchungsart)
+    """
+    checksum = 0
+    for row in buchungen:
+        checksum ^= zlib.crc32("|".join(str(value) for value in row).encode())
+    return BuchungStand(int(max(row[0] for row in buchungen)) if buchungen else 0, len(buchungen), str(checksum))
+
+
+def load_watermark(state_file: str) -> Optional[Watermark]:
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        state = json.load(f)
+    return Watermark(state["year"], state["config_hash"], BuchungStand(**state["stand"]), state["stapel"])
+
+
+def save_watermark(state_file: str, watermark: Watermark):
+    state = dataclasses.asdict(watermark)
+    state["exportiert_am"] = datetime.datetime.now().isoformat(timespec="seconds")
+    with open(f"{state_file}.part", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{state_file}.part", state_file)
@@ -10,17 +10,47 @@ __version__ = "1.0.0"
 __email__ = "v.rudolf@vfr-grossbottwar.de"
 
 import argparse
-from typing import Sequence
-from datev_export import datev_export
+import json
+import os
+import sys
+from typing import Dict, List, Sequence
+from datev_export import datasource, datev_export, profiling
+from datev_export.batch import parse_year_range
 
 import argparse
 
 
+def parse_years(value: str) -> List[int]:
+    """2020, 2019,2021 or a range like 2019-2022"""
+    return [year for part in value.split(",") for year in parse_year_range(part)]
+
+
+def get_year_kwargs(kwargs: Dict, year: int) -> Dict:
+    """
+    options of main for one of several years: --output is the directory of the files (like export_years),
+    --parquet gets one dataset per year (jahr=<year>, hive partitioned like the months), --state-file and
+    --bundle get the year appended
+    """
+    kwargs = dict(kwargs)
+    if kwargs["output"] is not None and kwargs["shard"] is None:
+        os.makedirs(kwargs["output"], exist_ok=True)
+        kwargs["output"] = os.path.join(kwargs["output"], f"datev_export_{year}.csv")
+    if kwargs["parquet"] is not None:
+        kwargs["parquet"] = os.path.join(kwargs["parquet"], f"jahr={year}")
+    for option in ["state_file", "bundle"]:
+        if kwargs[option] is not None:
+            root, ext = os.path.splitext(kwargs[option])
+            kwargs[option] = f"{root}_{year}{ext}"
+    return kwargs
+
+
 def parse_args(argv: Sequence[str] = None):
     parser = argparse.ArgumentParser(description="Connect to your 'jVerein' database.")
     parser.add_argument(
         "year",
-        type=int,
+        help="year, comma separated years or a range like 2019-2022; several years are fetched with one query "
+        "and written as one Buchungsstapel per year",
+        type=parse_years,
     )
     parser.add_argument(
         "--host",
@@ -30,11 +60,13 @@ def parse_args(argv: Sequence[str] = None):
     )
     parser.add_argument(
         "user",
+        nargs="?",
         help="username of your MySQL database",
         type=str,
     )
     parser.add_argument(
         "password",
+        nargs="?",
         help="password of your MySQL database",
         type=str,
     )
@@ -44,15 +76,211 @@ def parse_args(argv: Sequence[str] = None):
         help="name of the databse",
         type=str,
     )
+    parser.add_argument("--berater", default=123, help="Beraternummer in the DATEV header", type=int)
+    parser.add_argument("--mandant", default=321, help="Mandantennummer in the DATEV header", type=int)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="output file, '-' writes to stdout, .gz or .zip files are compressed (default: datev_export_<year>.csv), "
+        "the directory of the files when several years are exported",
+        type=str,
+    )
+    parser.add_argument(
+        "--encoding",
+        default="cp1252",
+        help="encoding of the export, DATEV expects cp1252 (Windows-1252)",
+        type=str,
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="re-read the written file line by line and check its encoding and the number of columns",
+    )
+    parser.add_argument(
+        "--parquet",
+        default=None,
+        help="additionally write the converted Buchungen to this directory as Parquet files per month",
+        type=str,
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="do not export, report all problems of the year (mappings, Steuerbuchungen, dates, text length) as JSON "
+        "to --output or stdout, exit code 1 if there are any; with --engine sql also the Steuerbuchungen the database "
+        "cannot pair and leaves to Python",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream the Buchungen one Umsatz at a time instead of loading the whole year",
+    )
+    parser.add_argument(
+        "--workers",
+        default=1,
+        help="number of processes converting the Buchungen",
+        type=int,
+    )
+    parser.add_argument(
+        "--engine",
+        default="loop",
+        choices=["loop", "vectorized", "tuple", "sql"],
+        help="row builder: 'loop' converts Buchung by Buchung, 'vectorized' uses column operations (faster on large years), "
+        "'tuple' works without pandas (quick start for small exports), 'sql' pairs the Steuerbuchungen in the database",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        choices=["month", "quarter"],
+        help="one Buchungsstapel per month or quarter, --output is then the directory of the files",
+    )
+    parser.add_argument("--bundle", default=None, help="additionally pack the sharded files into this ZIP file", type=str)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only export Buchungen added since the last run as a follow-up Buchungsstapel, its number is appended "
+        "to the --output file name (datev_export_<year>_<n>.csv)",
+    )
+    parser.add_argument(
+        "--state-file",
+        default=None,
+        help="state file of the incremental export (default: datev_export_<year>.state.json)",
+        type=str,
+    )
+    parser.add_argument(
+        "--metadata-cache",
+        default=None,
+        help="cache file for the buchungsart and konto tables, refreshed when their checksum changes",
+        type=str,
+    )
+    parser.add_argument(
+        "--sqlite",
+        default=None,
+        help="read from a SQLite copy of the database instead of MySQL",
+        type=str,
+    )
+    parser.add_argument(
+        "--snapshot",
+        default=None,
+        help="read from a snapshot directory written by --write-snapshot instead of MySQL",
+        type=str,
+    )
+    parser.add_argument(
+        "--write-snapshot",
+        default=None,
+        help="write the buchung, buchungsart and konto tables to this directory (Feather files) and exit",
+        type=str,
+    )
+    parser.add_argument(
+        "--pool-size",
+        default=None,
+        help="use a MySQL connection pool of this size and fetch independent tables concurrently",
+        type=int,
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="write a JSON report with time, rows and peak memory of every export stage to this file",
+        type=str,
+    )
+    parser.add_argument(
+        "--profile-cprofile",
+        action="store_true",
+        help="additionally write cProfile stats of every stage next to the --profile report",
+    )
     args = parser.parse_args(argv)
+    if args.engine == "sql" and args.snapshot:
+        parser.error("--engine sql pairs the Steuerbuchungen in the database and cannot read a --snapshot")
+    if args.metadata_cache and (args.sqlite or args.snapshot):
+        parser.error("--metadata-cache is validated with CHECKSUM TABLE and only works with MySQL")
+    if len(args.year) > 1 and args.output == "-" and not args.check:
+        parser.error("several years are written to one file per year, --output must be a directory")
     return {
-        "year": args.year,
+        "years": args.year,
         "host": args.host,
         "user": args.user,
         "password": args.password,
         "database": args.database,
+        "output": args.output,
+        "stream": args.stream,
+        "workers": args.workers,
+        "engine": args.engine,
+        "encoding": args.encoding,
+        "verify": args.verify,
+        "check": args.check,
+        "parquet": args.parquet,
+        "shard": args.shard,
+        "bundle": args.bundle,
+        "berater": args.berater,
+        "mandant": args.mandant,
+        "incremental": args.incremental,
+        "state_file": args.state_file,
+        "metadata_cache": args.metadata_cache,
+        "sqlite": args.sqlite,
+        "snapshot": args.snapshot,
+        "write_snapshot": args.write_snapshot,
+        "pool_size": args.pool_size,
+        "profile": args.profile,
+        "profile_cprofile": args.profile_cprofile,
     }
 
 
 if __name__ == "__main__":
-    datev_export.main(**parse_args())
+    kwargs = parse_args()
+    years = kwargs.pop("years")
+    snapshot_dir = kwargs.pop("write_snapshot")
+    profile = kwargs.pop("profile")
+    check = kwargs.pop("check")
+    exit_code = 0
+    if kwargs.pop("profile_cprofile") and profile:
+        profiler = profiling.enable_profiling(cprofile_prefix=os.path.splitext(profile)[0])
+    elif profile:
+        profiler = profiling.enable_profiling()
+    source = datasource.open_datasource(
+        kwargs.pop("host"),
+        kwargs.pop("user"),
+        kwargs.pop("password"),
+        kwargs.pop("database"),
+        sqlite=kwargs.pop("sqlite"),
+        snapshot=kwargs.pop("snapshot"),
+        pool_size=kwargs.pop("pool_size"),
+    )
+    if snapshot_dir:
+        datasource.write_snapshot(source, snapshot_dir)
+    elif check:
+        reports = [
+            datev_export.check(year, metadata_cache=kwargs["metadata_cache"], source=source, engine=kwargs["engine"])
+            for year in years
+        ]
+        report = json.dumps(reports, indent=2, ensure_ascii=False)
+        if kwargs["output"] in (None, "-"):
+            print(report)
+        else:
+            with open(kwargs["output"], "w", encoding="utf-8") as f:
+                f.write(report)
+        for year_report in reports:
+            print(f"{year_report['year']}: {year_report['summary'] or 'no problems'}", file=sys.stderr)
+        exit_code = int(any(year_report["problems"] for year_report in reports))
+    elif len(years) > 1 and not any(kwargs[option] for option in ["stream", "incremental", "shard", "parquet"]):
+        datev_export.export_years(
+            years,
+            source=source,
+            output_dir=kwargs["output"],
+            workers=kwargs["workers"],
+            metadata_cache=kwargs["metadata_cache"],
+            engine=kwargs["engine"],
+            berater=kwargs["berater"],
+            mandant=kwargs["mandant"],
+            encoding=kwargs["encoding"],
+            verify=kwargs["verify"],
+        )
+    elif len(years) > 1:
+        for year in years:
+            datev_export.main(year, source=source, **get_year_kwargs(kwargs, year))
+    else:
+        datev_export.main(years[0], source=source, **kwargs)
+    if isinstance(source, datasource.MySQLPoolSource):
+        print(json.dumps({"pool_size": source.pool_size, "queries": source.query_timings}, indent=2), file=sys.stderr)
+    source.close()
+    if profile:
+        profiler.write_report(profile)
+    sys.exit(exit_code)
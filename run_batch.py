@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+"""
+run_batch.py: Datev Export für alle Mandanten eines Manifests
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import argparse
+import json
+import sys
+from typing import Sequence
+
+from datev_export import batch
+
+
+def parse_args(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="Export several 'jVerein' databases listed in a manifest.")
+    parser.add_argument("manifest", help="JSON manifest with connection, Mandant, Berater, years and config per client")
+    parser.add_argument(
+        "--output-dir",
+        default="datev_export",
+        help="one sub directory per client, summary.json is written here",
+        type=str,
+    )
+    parser.add_argument("--workers", default=4, help="number of clients exported at the same time", type=int)
+    args = parser.parse_args(argv)
+    return {"manifest": args.manifest, "output_dir": args.output_dir, "workers": args.workers}
+
+
+if __name__ == "__main__":
+    kwargs = parse_args()
+    summary = batch.run_batch(batch.load_manifest(kwargs["manifest"]), kwargs["output_dir"], kwargs["workers"])
+    print(json.dumps({key: value for key, value in summary.items() if key != "results"}, indent=2))
+    if summary["failed"]:
+        sys.exit(1)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""
+run_service.py: Startet den Datev Export als HTTP Dienst
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import argparse
+from typing import Sequence
+
+from datev_export import service
+
+
+def parse_args(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="Serve DATEV exports of your 'jVerein' database over HTTP.")
+    parser.add_argument("user", nargs="?", help="username of your MySQL database", type=str)
+    parser.add_argument("password", nargs="?", help="password of your MySQL database", type=str)
+    parser.add_argument("--host", default="localhost", help="host IP of your MySQL database", type=str)
+    parser.add_argument("--database", default="jverein", help="name of the databse", type=str)
+    parser.add_argument("--sqlite", default=None, help="read from a SQLite copy of the database", type=str)
+    parser.add_argument("--snapshot", default=None, help="read from a snapshot directory", type=str)
+    parser.add_argument("--pool-size", default=None, help="use a MySQL connection pool of this size", type=int)
+    parser.add_argument("--metadata-cache", default=None, help="cache file for the buchungsart and konto tables", type=str)
+    parser.add_argument(
+        "--engine",
+        default="tuple",
+        choices=["loop", "vectorized", "tuple", "sql"],
+        help="row builder of the exports, see run.py",
+    )
+    parser.add_argument("--listen", default="127.0.0.1", help="address the service listens on", type=str)
+    parser.add_argument("--port", default=8080, help="port the service listens on", type=int)
+    parser.add_argument("--cache-dir", default="datev_export_cache", help="directory of the cached exports", type=str)
+    parser.add_argument(
+        "--cache-size",
+        default=service.CACHE_SIZE // (1024 * 1024),
+        help="MB of cached exports, the least recently used ones are removed beyond",
+        type=int,
+    )
+    args = parser.parse_args(argv)
+    if args.engine == "sql" and args.snapshot:
+        parser.error("--engine sql pairs the Steuerbuchungen in the database and cannot read a --snapshot")
+    if args.metadata_cache and (args.sqlite or args.snapshot):
+        parser.error("--metadata-cache is validated with CHECKSUM TABLE and only works with MySQL")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    connection = {
+        "host": args.host,
+        "user": args.user,
+        "password": args.password,
+        "database": args.database,
+        "sqlite": args.sqlite,
+        "snapshot": args.snapshot,
+        "pool_size": args.pool_size,
+    }
+    cache = service.ResultCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    export_service = service.ExportService(connection, cache, args.engine, args.metadata_cache)
+    print(f"serving DATEV exports on http://{args.listen}:{args.port}/export?periode=<year>")
+    service.serve(export_service, args.listen, args.port)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""
+run_validate.py: Prüft einen Datev Buchungsstapel oder vergleicht zwei Exporte
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import argparse
+import collections
+import json
+import sys
+from typing import Sequence
+
+from datev_export.diff import DIFF_BUCKETS, diff_datev_files
+from datev_export.validate import validate_datev_file
+
+
+def parse_args(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="Validate or compare DATEV Buchungsstapel written by run.py.")
+    parser.add_argument("--workers", default=1, help="number of processes reading the file(s)", type=int)
+    parser.add_argument("--encoding", default="cp1252", help="encoding of the export(s)", type=str)
+    commands = parser.add_subparsers(dest="command", required=True)
+    validate = commands.add_parser("validate", help="check header, column count and field formats of an export")
+    validate.add_argument("file", help="export to check, .gz and .zip files are read compressed")
+    diff = commands.add_parser("diff", help="added, removed and changed Belege (Belegfeld 1) between two exports")
+    diff.add_argument("old", help="export before the change")
+    diff.add_argument("new", help="export after the change")
+    diff.add_argument("--output", default="-", help="JSON lines file of the differences, '-' for stdout", type=str)
+    diff.add_argument("--buckets", default=DIFF_BUCKETS, help="temporary files per export, more for larger files", type=int)
+    return vars(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    kwargs = parse_args()
+    if kwargs["command"] == "validate":
+        report = validate_datev_file(kwargs["file"], kwargs["workers"], kwargs["encoding"])
+        print(json.dumps(report.to_dict(), indent=2, ensure_ascii=False))
+        if not report.ok:
+            sys.exit(1)
+    else:
+        counts = collections.Counter()
+        output = sys.stdout if kwargs["output"] == "-" else open(kwargs["output"], "w", encoding="utf-8")
+        with output:
+            for difference in diff_datev_files(
+                kwargs["old"], kwargs["new"], kwargs["workers"], kwargs["buckets"], kwargs["encoding"]
+            ):
+                counts[difference["status"]] += 1
+                output.write(json.dumps(difference, ensure_ascii=False) + "\n")
+        print(json.dumps(dict(counts)), file=sys.stderr)
+        if counts:
+            sys.exit(1)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""
+conftest.py: Synthetische jverein Datenbank (SQLite) für die Tests des Datev Exports
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import importlib
+import shutil
+import sqlite3
+import sys
+from typing import List
+
+import pytest
+
+# the synthetic dataset is generated for the example config
+sys.modules.setdefault("datev_export.custom_defines", importlib.import_module("datev_export.example_custom_defines"))
+
+from benchmarks.generate_dataset import generate_dataset
+
+
+@pytest.fixture(scope="session")
+def jverein_db(tmp_path_factory) -> str:
+    """generated once per session, tests changing Buchungen use jverein_copy"""
+    path = str(tmp_path_factory.mktemp("jverein") / "jverein.db")
+    generate_dataset(path, rows=600, years=range(2019, 2022), seed=0)
+    return path
+
+
+@pytest.fixture
+def jverein_copy(jverein_db, tmp_path) -> str:
+    path = str(tmp_path / "jverein.db")
+    shutil.copyfile(jverein_db, path)
+    return path
+
+
+def add_buchung(path: str, name: str, betrag: float, zweck: str, datum: str, konto: int = 1, buchungsart: int = 1) -> int:
+    """inserts a Buchung (buchungsart 1 has no tax), returns its id"""
+    cnxn = sqlite3.connect(path)
+    id = cnxn.execute("SELECT MAX(id) + 1 FROM buchung").fetchone()[0]
+    cnxn.execute(
+        "INSERT INTO buchung (id, konto, name, betrag, zweck, datum, buchungsart) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (id, konto, name, betrag, zweck, datum, buchungsart),
+    )
+    cnxn.commit()
+    cnxn.close()
+    return id
+
+
+def read_rows(path: str) -> List[str]:
+    """the booking rows of a Buchungsstapel, without header and column names"""
+    with open(path, encoding="cp1252", newline="") as f:
+        return f.read().split("\r\n")[2:-1]
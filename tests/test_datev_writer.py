@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+test_datev_writer.py: Der DatevWriter schreibt über eine .part Datei, komprimiert auf Wunsch und prüft den Stapel
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import pytest
+
+from datev_export.datev_writer import DatevWriter, open_binary, verify_datev_file
+
+HEADER = ["EXTF", 700]
+COLUMNS = ["Umsatz", "Buchungstext"]
+
+
+def test_part_datei_wird_umbenannt(tmp_path):
+    target = tmp_path / "stapel.csv"
+    with DatevWriter(str(target), HEADER, COLUMNS) as writer:
+        writer.writerows([["10,00", "Kaffee"], ["20,00", "Kuchen"]])
+        assert (tmp_path / "stapel.csv.part").exists()
+        assert not target.exists()
+    assert [path.name for path in tmp_path.iterdir()] == ["stapel.csv"]
+    assert target.read_bytes() == b"EXTF;700\r\nUmsatz;Buchungstext\r\n10,00;Kaffee\r\n20,00;Kuchen\r\n"
+    assert writer.rows == 2
+
+
+def test_abbruch_behaelt_vorherigen_export(tmp_path):
+    target = tmp_path / "stapel.csv"
+    target.write_bytes(b"vorheriger Export")
+    with pytest.raises(RuntimeError):
+        with DatevWriter(str(target), HEADER, COLUMNS) as writer:
+            writer.writerow(["10,00", "Kaffee"])
+            raise RuntimeError("Verbindung verloren")
+    assert [path.name for path in tmp_path.iterdir()] == ["stapel.csv"]
+    assert target.read_bytes() == b"vorheriger Export"
+
+
+@pytest.mark.parametrize("name, compression", [("stapel.csv.gz", "gz"), ("stapel.zip", "zip")])
+def test_komprimiert_wie_unkomprimiert(tmp_path, name, compression):
+    rows = [["10,00", "Café €"], ["20,00", "Nachtrag ā ☃"]]
+    with DatevWriter(str(tmp_path / "stapel.csv"), HEADER, COLUMNS) as writer:
+        writer.writerows(rows)
+    with DatevWriter(str(tmp_path / name), HEADER, COLUMNS, verify=True) as writer:
+        writer.writerows(rows)
+    with open_binary(str(tmp_path / name), compression) as f:
+        data = f.read()
+    assert data == (tmp_path / "stapel.csv").read_bytes()
+    # characters cp1252 does not know lose their accent or become "?"
+    assert "Café €".encode("cp1252") in data and b"Nachtrag a ?" in data
+    assert verify_datev_file(str(tmp_path / name), len(COLUMNS), compression=compression) == 2
+
+
+def test_verify_entfernt_fehlerhafte_datei(tmp_path):
+    target = tmp_path / "stapel.csv"
+    with pytest.raises(ValueError, match="row 4 has 1 instead of 2 columns"):
+        with DatevWriter(str(target), HEADER, COLUMNS, verify=True) as writer:
+            writer.writerows([["10,00", "Kaffee"], ["20,00"]])
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_verify_prueft_kodierung(tmp_path):
+    target = tmp_path / "stapel.csv"
+    # 0x81 is not defined in cp1252
+    target.write_bytes(b"EXTF;700\r\nUmsatz;Buchungstext\r\n10,00;Kaffee\x81\r\n")
+    with pytest.raises(ValueError, match="is not valid cp1252"):
+        verify_datev_file(str(target), len(COLUMNS))
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+"""
+test_engines.py: Alle Engines schreiben denselben Buchungsstapel wie die loop Engine
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import pytest
+from conftest import read_rows
+
+from datev_export import datev_export
+
+ENGINES = ["vectorized", "tuple", "sql"]
+
+
+@pytest.fixture(scope="module")
+def loop_export(jverein_db, tmp_path_factory):
+    output = tmp_path_factory.mktemp("loop") / "export.csv"
+    datev_export.main(2020, sqlite=jverein_db, output=str(output), engine="loop")
+    return read_rows(output)
+
+
+@pytest.mark.parametrize("options", [{}, {"stream": True}, {"workers": 2}], ids=["", "stream", "workers"])
+@pytest.mark.parametrize("engine", ENGINES)
+def test_wie_loop(jverein_db, tmp_path, loop_export, engine, options):
+    output = tmp_path / "export.csv"
+    datev_export.main(2020, sqlite=jverein_db, output=str(output), engine=engine, **options)
+    assert read_rows(output) == loop_export
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+"""
+test_export_years.py: Der Export mehrerer Jahre schreibt je Jahr denselben Stapel wie ein einzelner Export
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import pytest
+from conftest import read_rows
+
+import run
+from datev_export import datev_export
+
+YEARS = [2019, 2020, 2021]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("engine", ["loop", "tuple"])
+def test_wie_einzelne_jahre(jverein_db, tmp_path, engine, workers):
+    outputs = datev_export.export_years(
+        YEARS, sqlite=jverein_db, output_dir=str(tmp_path / "jahre"), engine=engine, workers=workers
+    )
+    assert outputs == [str(tmp_path / "jahre" / f"datev_export_{year}.csv") for year in YEARS]
+    for year, path in zip(YEARS, outputs):
+        output = tmp_path / f"{year}.csv"
+        datev_export.main(year, sqlite=jverein_db, output=str(output), engine=engine)
+        with open(path, encoding="cp1252") as f:
+            # Wirtschaftsjahresbeginn
+            assert f.readline().split(";")[12] == f"{year}0101"
+        assert read_rows(path) == read_rows(output)
+
+
+def test_stdout_nur_fuer_ein_jahr():
+    with pytest.raises(SystemExit):
+        run.parse_args(["2019-2021", "--output", "-"])
+    assert run.parse_args(["2020", "--output", "-"])["output"] == "-"
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""
+test_incremental.py: Der inkrementelle Export schreibt nur neue Umsätze als nummerierten Folgestapel
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import pytest
+from conftest import add_buchung, read_rows
+
+from datev_export import datev_export
+from datev_export.watermark import load_watermark
+
+
+@pytest.mark.parametrize("engine", ["loop", "tuple"])
+def test_folgestapel(jverein_copy, tmp_path, engine):
+    output = tmp_path / "export.csv"
+    options = dict(sqlite=jverein_copy, engine=engine, incremental=True, state_file=str(tmp_path / "stand.json"))
+    datev_export.main(2020, output=str(output), **options)
+    erster_stapel = read_rows(output)
+    assert erster_stapel and load_watermark(options["state_file"]).stapel == 0
+
+    # nothing new, no follow-up Stapel
+    datev_export.main(2020, output=str(output), **options)
+    assert not (tmp_path / "export_1.csv").exists()
+
+    add_buchung(jverein_copy, "900001", 12.5, "Nachtrag", "2020-12-30")
+    datev_export.main(2020, output=str(output), **options)
+    [row] = read_rows(tmp_path / "export_1.csv")
+    assert row.startswith("12,5;") and ";900001;" in row and ";Nachtrag;" in row
+    assert read_rows(output) == erster_stapel
+    assert load_watermark(options["state_file"]).stapel == 1
+
+
+def test_geaenderter_umsatz_exportiert_alles(jverein_copy, tmp_path):
+    output = tmp_path / "export.csv"
+    options = dict(sqlite=jverein_copy, engine="tuple", incremental=True, state_file=str(tmp_path / "stand.json"))
+    add_buchung(jverein_copy, "900001", 12.5, "Nachtrag", "2020-12-30")
+    datev_export.main(2020, output=str(output), **options)
+    anzahl = len(read_rows(output))
+
+    # a second Buchung of an already exported Umsatz changes it, the whole year is exported again
+    add_buchung(jverein_copy, "900001", 7.5, "Nachtrag 2", "2020-12-30")
+    datev_export.main(2020, output=str(output), **options)
+    assert not (tmp_path / "export_1.csv").exists()
+    assert len(read_rows(output)) == anzahl + 1
+
+
+def test_stapel_namen():
+    assert datev_export.get_stapel_output("export.csv", 2) == "export_2.csv"
+    assert datev_export.get_stapel_output("out/datev_export_2020.csv.gz", 3) == "out/datev_export_2020_3.csv.gz"
+    assert datev_export.get_stapel_output("export.zip", 1) == "export_1.zip"
+    assert datev_export.get_stapel_output("-", 1) == "-"
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+"""
+test_service.py: Der Export Service liefert Exporte aus dem Cache, solange sich die Buchungen nicht ändern
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import os
+
+import pytest
+from conftest import add_buchung
+
+from datev_export import datev_export
+from datev_export.service import ExportService, ResultCache
+
+
+@pytest.fixture
+def export_service(jverein_copy, tmp_path):
+    export_service = ExportService({"sqlite": jverein_copy}, ResultCache(str(tmp_path / "cache")))
+    yield export_service
+    export_service.close()
+
+
+def read_export(export_service: ExportService, periode: str):
+    f, status = export_service.export(periode, 123, 321)
+    with f:
+        # without the header line, it contains the creation time
+        return f.read().split(b"\r\n", 1)[1], status
+
+
+def test_cache(jverein_copy, tmp_path, export_service):
+    stapel, status = read_export(export_service, "2020")
+    assert status == "miss"
+    assert read_export(export_service, "2020") == (stapel, "hit")
+    output = tmp_path / "export.csv"
+    datev_export.main(2020, sqlite=jverein_copy, output=str(output), engine="tuple")
+    assert output.read_bytes().split(b"\r\n", 1)[1] == stapel
+
+    # a new Buchung changes the Stand of the year and with it the cache key
+    add_buchung(jverein_copy, "900001", 12.5, "Nachtrag", "2020-12-30")
+    neuer_stapel, status = read_export(export_service, "2020")
+    assert status == "miss" and neuer_stapel != stapel
+
+
+def test_monate_werden_zusammen_exportiert(export_service):
+    assert read_export(export_service, "2020-03")[1] == "miss"
+    assert read_export(export_service, "2020-04")[1] == "hit"
+    assert export_service.counters == {"hit": 1, "miss": 1, "shared": 0}
+
+
+def test_lru(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=10)
+    for key in ["a", "b"]:
+        (tmp_path / key).write_bytes(b"123456")
+        cache.put(key, str(tmp_path / key))
+        # mtime has a limited resolution, the older entry is set back explicitly
+        os.utime(os.path.join(cache.directory, f"{key}.csv"), (0, 0) if key == "a" else None)
+    assert cache.open("a") is None
+    with cache.open("b") as f:
+        assert f.read() == b"123456"
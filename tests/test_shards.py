@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+test_shards.py: Die Monats- und Quartalsstapel enthalten zusammen genau die Buchungen des Jahresstapels
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import zipfile
+
+import pytest
+from conftest import read_rows
+
+from datev_export import datev_export
+
+
+@pytest.fixture(scope="module")
+def jahres_export(jverein_db, tmp_path_factory):
+    output = tmp_path_factory.mktemp("jahr") / "export.csv"
+    datev_export.main(2020, sqlite=jverein_db, output=str(output), engine="tuple")
+    return read_rows(output)
+
+
+@pytest.mark.parametrize("shard, anzahl", [("month", 12), ("quarter", 4)])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_vereinigung_wie_jahresstapel(jverein_db, tmp_path, jahres_export, shard, anzahl, workers):
+    output_dir = tmp_path / "stapel"
+    bundle = tmp_path / "stapel.zip"
+    datev_export.main(
+        2020, sqlite=jverein_db, output=str(output_dir), shard=shard, bundle=str(bundle), engine="tuple", workers=workers
+    )
+    perioden = datev_export.get_perioden(2020, shard)
+    assert len(perioden) == anzahl
+    rows = []
+    for name, start, end in perioden:
+        path = output_dir / f"datev_export_{name}.csv"
+        with open(path, encoding="cp1252") as f:
+            header = f.readline().split(";")
+        # Datum vom and Datum bis of the header are the period
+        assert header[14:16] == [start.strftime("%Y%m%d"), end.strftime("%Y%m%d")]
+        rows += read_rows(path)
+    assert sorted(rows) == sorted(jahres_export)
+    with zipfile.ZipFile(bundle) as archive:
+        assert archive.namelist() == [f"datev_export_{name}.csv" for name, _, _ in perioden]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+test_sql_engine.py: Die sql Engine paart Steuerbuchungen wie die Python Engines
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import datetime
+import importlib
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.modules.setdefault("datev_export.custom_defines", importlib.import_module("datev_export.example_custom_defines"))
+
+from datev_export import datev_export
+from datev_export.datasource import Buchung, open_datasource
+
+# the Steuerkonten of example_custom_defines, 9651 (5%) is used from 2020-06-30 to 2020-12-31
+BUCHUNGSARTEN = [(1, 8400), (2, 9651), (3, 9650)]
+KONTEN = [(1, "1", "Hauptkonto"), (2, "2", "Barkasse")]
+DATUM = datetime.date(2020, 8, 1)
+
+
+def create_database(path: str, buchungen: list):
+    cnxn = sqlite3.connect(path)
+    cnxn.execute("CREATE TABLE buchungsart (id INTEGER PRIMARY KEY, nummer INTEGER)")
+    cnxn.execute("CREATE TABLE konto (id INTEGER PRIMARY KEY, nummer TEXT, bezeichnung TEXT)")
+    cnxn.execute(
+        "CREATE TABLE buchung (id INTEGER PRIMARY KEY, konto INTEGER, name TEXT, betrag DOUBLE, zweck TEXT, "
+        "datum DATE, buchungsart INTEGER, splitid INTEGER, splittyp INTEGER)"
+    )
+    cnxn.executemany("INSERT INTO buchungsart VALUES (?, ?)", BUCHUNGSARTEN)
+    cnxn.executemany("INSERT INTO konto VALUES (?, ?, ?)", KONTEN)
+    cnxn.executemany(
+        "INSERT INTO buchung VALUES (?, 1, ?, ?, ?, ?, ?, NULL, NULL)",
+        [(id, name, betrag, zweck, DATUM.isoformat(), buchungsart) for id, name, betrag, zweck, buchungsart in buchungen],
+    )
+    cnxn.commit()
+    cnxn.close()
+
+
+class SqlEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, "jverein.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, engine: str) -> str:
+        output = os.path.join(self.directory.name, f"{engine}.csv")
+        datev_export.main(2020, sqlite=self.database, engine=engine, output=output)
+        with open(output, encoding="cp1252") as f:
+            # without the header line, it contains the creation time
+            return f.read().split("\n", 1)[1]
+
+    def test_paare_wie_tuple_engine(self):
+        create_database(
+            self.database,
+            [
+                (1, "100", 10.0, "Kaffee", 1),
+                (2, "100", 0.5, "Kaffee USt", 2),
+                (3, "101", 20.0, "Kuchen", 1),
+            ],
+        )
+        self.assertEqual(self.export("sql"), self.export("tuple"))
+
+    def test_halber_cent(self):
+        # 2.50 * 5% = 0.125: Python rounds to 0.12, SQLite to 0.13, so 0.14 is only within a cent for SQLite
+        create_database(self.database, [(1, "100", 2.5, "Kaffee", 1), (2, "100", 0.14, "Kaffee USt", 2)])
+        source = open_datasource(sqlite=self.database)
+        buchungsarten, _ = source.get_metadaten()
+        umsaetze = source.get_gepaarte_umsaetze(2020, None, datev_export.get_jverein_steuer_konten(buchungsarten))
+        source.close()
+        # the Umsatz is left to Python
+        self.assertEqual([type(buchung) for _, _, buchungen in umsaetze for buchung in buchungen], [Buchung, Buchung])
+        for engine in ["tuple", "sql"]:
+            with self.subTest(engine=engine), self.assertRaisesRegex(IOError, "Cannot find corresponding netto Buchung"):
+                self.export(engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+test_validate.py: Validierung eines geschriebenen Buchungsstapels und Vergleich zweier Exporte
+"""
+
+__author__ = "Vinzent Rudolf"
+__version__ = "1.0.0"
+__email__ = "v.rudolf@vfr-grossbottwar.de"
+
+import sqlite3
+
+import pytest
+from conftest import add_buchung, read_rows
+
+from datev_export import datev_export
+from datev_export.datev_record import COLUMN_INDEX
+from datev_export.diff import diff_datev_files
+from datev_export.validate import validate_datev_file
+
+
+@pytest.fixture
+def export(jverein_copy, tmp_path):
+    output = tmp_path / "export.csv"
+    datev_export.main(2020, sqlite=jverein_copy, output=str(output), engine="tuple")
+    return output
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_export_ist_gueltig(export, workers):
+    # small chunks, so the rows are split between the workers
+    report = validate_datev_file(str(export), workers=workers, chunk_size=4096)
+    assert report.ok, report.to_dict()
+    assert report.rows == len(read_rows(export))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_fehler_mit_zeilennummer(export, workers):
+    with open(export, encoding="cp1252", newline="") as f:
+        lines = f.read().split("\r\n")
+    row = lines[9].split(";")
+    row[COLUMN_INDEX["Umsatz"]] = "-5,00"
+    row[COLUMN_INDEX["Konto"]] = "Kasse"
+    lines[9] = ";".join(row)
+    with open(export, "w", encoding="cp1252", newline="") as f:
+        f.write("\r\n".join(lines))
+
+    report = validate_datev_file(str(export), workers=workers, chunk_size=4096)
+    assert report.problems == {"umsatz": 1, "konto": 1}
+    assert [line for line, _ in report.examples["umsatz"]] == [10]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_diff(jverein_copy, export, tmp_path, workers):
+    assert list(diff_datev_files(str(export), str(export), workers=workers, buckets=4)) == []
+
+    add_buchung(jverein_copy, "900001", 12.5, "Nachtrag", "2020-12-30")
+    cnxn = sqlite3.connect(jverein_copy)
+    [(id, name)] = cnxn.execute(
+        "SELECT id, name FROM buchung WHERE splitid IS NULL AND buchungsart = 1 AND datum LIKE '2020-%' LIMIT 1"
+    )
+    cnxn.execute("UPDATE buchung SET betrag = betrag + 1000 WHERE id = ?", (id,))
+    cnxn.commit()
+    cnxn.close()
+    neu = tmp_path / "neu.csv"
+    datev_export.main(2020, sqlite=jverein_copy, output=str(neu), engine="tuple")
+
+    # sorted by Belegfeld 1 within each bucket only
+    differences = diff_datev_files(str(export), str(neu), workers=workers, buckets=4)
+    changed, added = sorted(differences, key=lambda difference: difference["belegfeld"])
+    assert changed["belegfeld"] == name and changed["status"] == "changed" and "Umsatz" in changed["fields"]
+    assert added["belegfeld"] == "900001" and added["status"] == "added"
+    assert added["removed"] == [] and added["added"][0]["Buchungstext"] == "Nachtrag"